@@ -0,0 +1,848 @@
+#%%
+from jinja2 import Template
+import date_dimension
+
+#%%
+# Unit conversions
+miles_to_meters = 1609.34
+feet_to_meters = 0.3048
+secs_to_mins = 60
+secs_to_hrs = 3600
+
+# Question parameters
+report_year = 2025
+# Calendar days of the report year up to today (dim_date rows), the denominator for every rate
+period_filter = f"year = {report_year} AND calendar_date <= current_date"
+# Activity rows in the report year, by integer date key
+period_key_filter = f"date_key BETWEEN {report_year}0101 AND {report_year}1231"
+mt_everest_height = 29032
+x = 5  # fastest paces
+y = 10  # longest runs
+z = 10  # most kudos
+
+#%%
+# Clean up the house
+# staging reads from a relation called base (the raw activities)
+staging_sql = f"""
+    SELECT
+        -- GRAIN
+        id
+        ,TRY_CAST(regexp_extract(CAST(athlete AS VARCHAR), 'id'':\\s*(\\d+)', 1) AS BIGINT) AS athlete_id
+
+        -- DIMENSIONS
+        ,name
+        ,type
+        ,sport_type
+        ,workout_type
+        ,device_name
+        ,start_date AS start_date_utc
+        ,start_date_local
+        ,timezone
+        ,achievement_count
+        ,kudos_count
+        ,comment_count
+        ,athlete_count
+        ,photo_count
+        ,map
+        ,manual
+        ,gear_id
+        ,start_latlng
+        ,end_latlng
+        ,d.date_key
+        ,d.yyyy_mm AS start_date_local_yyyy_mm
+
+        -- STANDARDIZED MEASURES
+        ,distance AS distance_meters
+        ,moving_time AS moving_time_secs
+        ,elapsed_time AS elapsed_time_secs
+        ,elev_high AS elev_high_meters
+        ,elev_low AS elev_low_meters
+        ,total_elevation_gain AS total_elevation_gain_meters
+        ,round(distance / {miles_to_meters},2) AS distance_miles
+        ,round(moving_time / {secs_to_mins},2) AS moving_time_mins
+        ,round(moving_time / {secs_to_hrs},2) AS moving_time_hrs
+        ,round(elapsed_time / {secs_to_mins},2) AS elapsed_time_mins
+        ,round(elapsed_time / {secs_to_hrs},2) AS elapsed_time_hrs
+        ,round(total_elevation_gain / {feet_to_meters},2) AS total_elevation_gain_feet
+        ,round(elev_high / {feet_to_meters},2) AS elevn_high_feet
+        ,round(elev_low / {feet_to_meters},2) AS elev_low_feet
+
+        , CASE
+            WHEN distance_miles = 0
+            THEN 0.00
+            ELSE round(moving_time_mins / distance_miles,2)
+        END AS average_pace_mins_per_mile
+
+        -- OTHER MEASURES
+        ,average_speed --in meters per second by default
+        ,max_speed --in meters per second by default
+        ,average_cadence
+        ,average_watts
+        ,max_watts
+        ,weighted_average_watts
+        ,device_watts
+        ,kilojoules
+        ,has_heartrate
+        ,average_heartrate
+        ,max_heartrate
+        ,heartrate_opt_out
+        ,display_hide_heartrate_option
+        ,pr_count
+        ,total_photo_count
+        ,has_kudoed
+
+        -- OTHER COLS
+        ,upload_id
+        ,upload_id_str
+        ,external_id
+        ,from_accepted_tag
+        ,loaded_date
+
+    FROM base
+    LEFT JOIN dim_date d
+        ON d.date_key = year(start_date_local) * 10000 + month(start_date_local) * 100 + day(start_date_local)
+"""
+
+# Only runs in 2025
+runs_in_2025_sql = f'''
+            SELECT *
+            FROM staging
+            WHERE {period_key_filter}
+            AND type = 'Run'
+           '''
+
+
+def build_staging_tables(con, source_table: str = "raw_activities"):
+    # Materialize staging and runs_in_2025 so every question (and every cursor) reads the same tables
+    date_dimension.create_date_dimension(con, source_table)
+    con.execute(f"CREATE OR REPLACE TABLE staging AS WITH base AS (SELECT * FROM {source_table}) {staging_sql}")
+    con.execute(f"CREATE OR REPLACE TABLE runs_in_2025 AS {runs_in_2025_sql}")
+
+
+#%%
+# YoY change
+measures = [
+    'distance_miles'
+    ,'total_elevation_gain_feet'
+    ,'moving_time_hrs'
+]
+
+changes_sql_template = Template('''
+        WITH changes AS (
+            SELECT
+                d.year
+
+                -- Number of runs
+                ,COUNT(*) AS number_of_runs
+
+                -- Number of runs percentage change
+                ,ROUND(
+                    (COUNT(*)
+                        - LAG(COUNT(*)) OVER (ORDER BY d.year)
+                    )
+                    / LAG(COUNT(*)) OVER (ORDER BY d.year)
+                    * 100
+                , 2) AS pct_change_number_of_runs
+
+                {% for col in measures %}
+
+                    -- Total {{ col }}
+                    ,ROUND(SUM({{ col }}), 2) AS {{ col if col.startswith('total_') else 'total_' ~ col }}
+
+                    -- {{ col }} percentage change
+                    ,ROUND(
+                        (
+                            ROUND(SUM({{ col }}), 2)
+                            - LAG(ROUND(SUM({{ col }}), 2))
+                                OVER (ORDER BY d.year)
+                        )
+                        / LAG(ROUND(SUM({{ col }}), 2))
+                            OVER (ORDER BY d.year)
+                        * 100
+                    , 2) AS pct_change_{{ col }}
+
+                {% endfor %}
+
+            FROM staging s
+            JOIN dim_date d USING (date_key)
+            WHERE d.year > 2022
+                AND s.type = 'Run'
+            GROUP BY d.year
+            ORDER BY d.year
+        )
+        SELECT *
+        FROM changes
+        '''
+    )
+
+# Format the percentage changes
+pct_change_measures = [
+    'pct_change_distance_miles'
+    ,'pct_change_number_of_runs'
+    ,'pct_change_total_elevation_gain_feet'
+    ,'pct_change_moving_time_hrs'
+]
+
+format_yoy_sql_template = Template('''
+                WITH formats AS (
+                    SELECT
+                        *
+                        {% for col in metrics %}
+                        ,CASE
+                            WHEN {{ col }} IS NULL THEN 'N/A'
+                            ELSE CONCAT(CAST( {{ col }} AS VARCHAR), '%')
+                        END AS {{ col }}_formatted
+                        {% endfor %}
+                    FROM yoy
+                )
+                SELECT
+                    {% for col in metrics %}
+                        {{ col }}_formatted AS {{ col }}{% if not loop.last %},{% endif %}
+                    {% endfor %}
+                FROM formats
+        '''
+)
+
+yoy_sql = changes_sql_template.render(measures=measures)
+# The formatted query brings its own yoy so it can run on any cursor
+format_yoy_sql = f"""
+        WITH yoy AS ({yoy_sql})
+        SELECT * FROM ({format_yoy_sql_template.render(metrics=pct_change_measures)})
+"""
+
+#%%
+# Period spines from dim_date, so months/quarters without an activity still show up (as 0)
+# and rates are taken over the calendar rather than over the activities that happen to exist
+months_sql = f'''
+    months AS (
+        SELECT month_key, any_value(yyyy_mm) AS start_date_local_yyyy_mm
+        FROM dim_date
+        WHERE {period_filter}
+        GROUP BY month_key
+    )
+'''
+quarters_sql = f'''
+    quarters AS (
+        SELECT DISTINCT quarter_key, quarter
+        FROM dim_date
+        WHERE {period_filter}
+    )
+'''
+period_days_sql = f"(SELECT count(*) FROM dim_date WHERE {period_filter})"
+period_months_sql = f"(SELECT count(DISTINCT month_key) FROM dim_date WHERE {period_filter})"
+
+#%%
+# Every question, by name, in the order they appear in the report
+report_queries = {}
+
+##########################################################################################
+# 2025 YEAR IN SPORT
+##########################################################################################
+
+# Top sport
+report_queries["top_sport"] = f'''
+            SELECT type, COUNT(*) AS activity_frequency
+            FROM staging
+            WHERE {period_key_filter}
+            GROUP BY type
+            ORDER BY activity_frequency DESC
+           '''
+
+# Total days active (not just running)
+# Per month and grand total
+report_queries["days_active"] = f'''
+           WITH {months_sql}
+           , monthly AS (
+            SELECT m.start_date_local_yyyy_mm, count(DISTINCT s.date_key) AS total_days_active
+            FROM months m
+            LEFT JOIN staging s ON s.date_key // 100 = m.month_key
+            GROUP BY ALL
+            ORDER BY m.start_date_local_yyyy_mm
+           )
+            , total AS (
+                SELECT 'Grand total'
+                    ,count(DISTINCT date_key) AS total_days_active
+                FROM staging
+                WHERE {period_key_filter}
+            )
+            , pct AS (
+                SELECT 'Percentage of days active'
+                , CONCAT(CAST(ROUND((total_days_active/{period_days_sql})*100,2) AS VARCHAR),'%')
+                FROM total
+            )
+            SELECT * FROM monthly
+            UNION ALL
+            SELECT * FROM total
+            UNION ALL
+            SELECT * FROM pct
+           '''
+
+# Total days just running
+# Per month and grand total
+report_queries["days_running"] = f'''
+           WITH {months_sql}
+           , monthly AS (
+            SELECT m.start_date_local_yyyy_mm, count(DISTINCT r.date_key) AS total_days_running
+            FROM months m
+            LEFT JOIN runs_in_2025 r ON r.date_key // 100 = m.month_key
+            GROUP BY ALL
+            ORDER BY m.start_date_local_yyyy_mm
+           )
+            , total AS (
+                SELECT 'Grand total'
+                    ,count(DISTINCT date_key) AS total_days_running
+                FROM runs_in_2025
+            )
+            , pct AS (
+                SELECT 'Percentage of days active'
+                , CONCAT(CAST(ROUND((total_days_running/{period_days_sql})*100,2) AS VARCHAR),'%')
+                FROM total
+            )
+            SELECT * FROM monthly
+            UNION ALL
+            SELECT * FROM total
+            UNION ALL
+            SELECT * FROM pct
+           '''
+
+# Total distance active (not just running)
+# Per month and grand total
+report_queries["distance_active"] = f'''
+           WITH {months_sql}
+           , monthly AS (
+                SELECT m.start_date_local_yyyy_mm, round(coalesce(sum(s.distance_miles),0),2) as total_miles_active
+                FROM months m
+                LEFT JOIN staging s ON s.date_key // 100 = m.month_key
+                GROUP BY m.start_date_local_yyyy_mm
+                ORDER BY m.start_date_local_yyyy_mm
+            )
+            , total AS (
+                SELECT 'Grand total',round(sum(distance_miles),2) AS total_miles_active
+                FROM staging
+                WHERE {period_key_filter}
+            )
+            , monthly_avg AS
+                (
+                SELECT 'Monthly average',round(total_miles_active/{period_months_sql},2)
+                FROM total
+                )
+            SELECT * FROM monthly
+            UNION ALL
+            SELECT * FROM total
+            UNION ALL
+            SELECT *
+            FROM monthly_avg
+           '''
+
+# Total distance just running
+# Per month and grand total
+report_queries["distance_running"] = f'''
+           WITH {months_sql}
+           , monthly AS (
+                SELECT m.start_date_local_yyyy_mm, round(coalesce(sum(r.distance_miles),0),2) as total_miles_running
+                FROM months m
+                LEFT JOIN runs_in_2025 r ON r.date_key // 100 = m.month_key
+                GROUP BY m.start_date_local_yyyy_mm
+                ORDER BY m.start_date_local_yyyy_mm
+            )
+            , total AS (
+                SELECT 'Grand total',round(sum(distance_miles),2) AS total_miles_running
+                FROM runs_in_2025
+            )
+            , monthly_avg AS
+                (
+                SELECT 'Monthly average',round(total_miles_running/{period_months_sql},2)
+                FROM total
+                )
+            SELECT * FROM monthly
+            UNION ALL
+            SELECT * FROM total
+            UNION ALL
+            SELECT *
+            FROM monthly_avg
+           '''
+
+# Total time active (not just running)
+# Per month and grand total
+report_queries["time_active"] = f'''
+           WITH {months_sql}
+           , monthly AS (
+            SELECT m.start_date_local_yyyy_mm, round(coalesce(sum(s.moving_time_hrs),0),2) as moving_time_hrs_active
+            FROM months m
+            LEFT JOIN staging s ON s.date_key // 100 = m.month_key
+            GROUP BY ALL
+            ORDER BY m.start_date_local_yyyy_mm
+           )
+            , total AS (
+                SELECT 'Grand total',round(sum(moving_time_hrs),2) as moving_time_hrs_active
+                FROM staging
+                WHERE {period_key_filter}
+            )
+            , monthly_avg AS
+                (
+                SELECT 'Monthly average',round(moving_time_hrs_active/{period_months_sql},2)
+                FROM total
+                )
+            SELECT * FROM monthly
+            UNION ALL
+            SELECT * FROM total
+            UNION ALL
+            SELECT *
+            FROM monthly_avg
+           '''
+
+# Total time just running
+# Per month and grand total
+report_queries["time_running"] = f'''
+           WITH {months_sql}
+           , monthly AS (
+            SELECT m.start_date_local_yyyy_mm, round(coalesce(sum(r.moving_time_hrs),0),2) as moving_time_hrs_running
+            FROM months m
+            LEFT JOIN runs_in_2025 r ON r.date_key // 100 = m.month_key
+            GROUP BY ALL
+            ORDER BY m.start_date_local_yyyy_mm
+           )
+            , total AS (
+                SELECT 'Grand total',round(sum(moving_time_hrs),2) as moving_time_hrs_running
+                FROM runs_in_2025
+            )
+            , monthly_avg AS
+                (
+                SELECT 'Monthly average',round(moving_time_hrs_running/{period_months_sql},2)
+                FROM total
+                )
+            SELECT * FROM monthly
+            UNION ALL
+            SELECT * FROM total
+            UNION ALL
+            SELECT *
+            FROM monthly_avg
+           '''
+
+# Total elevation active (not just running)
+# Per month and grand total
+report_queries["elevation_active"] = f'''
+           WITH {months_sql}
+           , monthly AS (
+                SELECT m.start_date_local_yyyy_mm, round(coalesce(sum(s.total_elevation_gain_feet),0),2) as elevation_gain_feet_active
+                FROM months m
+                LEFT JOIN staging s ON s.date_key // 100 = m.month_key
+                GROUP BY m.start_date_local_yyyy_mm
+                ORDER BY m.start_date_local_yyyy_mm
+               )
+            , total AS (
+                SELECT 'Grand total',round(sum(total_elevation_gain_feet),2) AS elevation_gain_feet_active
+                FROM staging
+                WHERE {period_key_filter}
+            )
+            SELECT * FROM monthly
+            UNION ALL
+            SELECT * FROM total
+           '''
+
+# Total elevation just running
+# Per month and grand total
+report_queries["elevation_running"] = f'''
+           WITH {months_sql}
+           , monthly AS (
+                SELECT m.start_date_local_yyyy_mm, round(coalesce(sum(r.total_elevation_gain_feet),0),2) AS elevation_gain_feet_running
+                FROM months m
+                LEFT JOIN runs_in_2025 r ON r.date_key // 100 = m.month_key
+                GROUP BY m.start_date_local_yyyy_mm
+                ORDER BY m.start_date_local_yyyy_mm
+               )
+            , total AS (
+                SELECT 'Grand total',round(sum(total_elevation_gain_feet),2) AS elevation_gain_feet_running
+                FROM runs_in_2025
+            )
+            , everest AS (
+                SELECT 'Number of times climbed Mt. Everest'
+                    , ROUND(elevation_gain_feet_running / {mt_everest_height},2)
+                FROM total
+            )
+            SELECT * FROM monthly
+            UNION ALL
+            SELECT * FROM total
+            UNION ALL
+            SELECT * FROM everest
+           '''
+
+# Longest weekly activity streak (not just running)
+# There are 52 weeks populated so I had at least one activity per week in 2025
+report_queries["weekly_activity_streak"] = f'''
+        SELECT count(DISTINCT d.week_start) AS activity_weeks
+        FROM staging s
+        JOIN dim_date d USING (date_key)
+        WHERE d.year = {report_year}
+    '''
+
+# Longest weekly running streak
+# Weeks are ISO weeks from dim_date, so a streak can cross the new year without breaking
+report_queries["weekly_running_streak"] = '''
+    -- 1. One row per run week w/ assumption of if there is an entry in the Strava data, there was an activity logged
+    WITH activity_weeks AS (
+        SELECT DISTINCT
+            d.week_start AS activity_week
+        FROM runs_in_2025 r
+        JOIN dim_date d USING (date_key)
+    ),
+
+    -- 2. Order and look at previous week
+    ordered_days AS (
+        SELECT
+            activity_week
+            ,LAG(activity_week) OVER (ORDER BY activity_week) AS prev_date
+        FROM activity_weeks
+    ),
+
+    -- 3. Flag when a new streak starts
+    streak_flags AS (
+        SELECT
+            activity_week
+            ,CASE
+                WHEN prev_date IS NULL THEN 1
+                WHEN activity_week = prev_date + INTERVAL 7 DAY THEN 0
+                ELSE 1
+            END AS new_streak
+        FROM ordered_days
+    ),
+
+    -- 4. Assign streak group id
+    streak_groups AS (
+        SELECT
+            activity_week
+            ,SUM(new_streak) OVER (ORDER BY activity_week) AS streak_id
+        FROM streak_flags
+    ),
+
+    -- 5. Count weeks per streak
+    streak_lengths AS (
+        SELECT
+            streak_id
+            ,COUNT(*) AS streak_length
+            ,MIN(activity_week) AS streak_start
+            ,MAX(activity_week) AS streak_end
+        FROM streak_groups
+        GROUP BY streak_id
+    )
+
+    -- 6. Max streak and when
+    SELECT
+        MAX(streak_length) AS max_running_streak_week
+        ,streak_start AS streak_week_start_date
+        ,streak_end AS streak_week_start_date
+    FROM streak_lengths
+    WHERE streak_length =
+        (SELECT MAX(streak_length)
+        FROM streak_lengths)
+    GROUP BY streak_id,streak_start,streak_end
+    '''
+
+# Top z runs with most kudos
+report_queries["top_kudos_runs"] = f'''
+    WITH ranked_runs AS (
+        SELECT
+            name
+            ,DATE(start_date_local) AS start_date_local
+            ,average_pace_mins_per_mile
+            ,distance_miles
+            ,kudos_count
+            ,RANK() OVER (
+                ORDER BY kudos_count DESC
+            ) AS kudos_rank
+        FROM runs_in_2025
+    )
+    SELECT
+        name
+        ,start_date_local
+        ,average_pace_mins_per_mile
+        ,distance_miles
+        ,kudos_count
+    FROM ranked_runs
+    WHERE kudos_rank <= {z}
+    ORDER BY kudos_rank
+'''
+
+# Which countries, cities and parks did I start in or pass through in 2025?
+# Tagged offline against the boundary files in strava_data/regions (regions.py)
+report_queries["regions_visited"] = f'''
+    SELECT
+        g.region_type
+        ,g.name
+        ,count(DISTINCT s.id) FILTER (WHERE ar.relation = 'start') AS activities_started
+        ,count(DISTINCT s.id) FILTER (WHERE ar.relation = 'pass') AS activities_passed_through
+        ,count(DISTINCT s.id) FILTER (WHERE ar.relation = 'start' AND s.type = 'Run') AS runs_started
+        ,round(coalesce(sum(s.distance_miles) FILTER (WHERE ar.relation = 'start'), 0),2) AS miles_started
+    FROM activity_regions ar
+    JOIN regions g USING (region_id)
+    JOIN staging s USING (id)
+    WHERE {period_key_filter}
+    GROUP BY g.region_type, g.name
+    ORDER BY g.region_type, activities_passed_through DESC
+'''
+
+##########################################################################################
+# ADDITIONAL QUESTIONS
+##########################################################################################
+
+# Longest daily streak of activity (not just run)
+report_queries["daily_activity_streak"] = f'''
+    -- 1. One row per active day w/ assumption of if there is an entry in the Strava data, there was an activity logged
+    WITH activity_days AS (
+        SELECT DISTINCT
+            d.calendar_date AS activity_date
+        FROM staging s
+        JOIN dim_date d USING (date_key)
+        WHERE d.year = {report_year}
+    ),
+
+    -- 2. Order and look at previous day
+    ordered_days AS (
+        SELECT
+            activity_date
+            ,LAG(activity_date) OVER (ORDER BY activity_date) AS prev_date
+        FROM activity_days
+    ),
+
+    -- 3. Flag when a new streak starts
+    streak_flags AS (
+        SELECT
+            activity_date
+            ,CASE
+                WHEN prev_date IS NULL THEN 1
+                WHEN activity_date = prev_date + INTERVAL 1 DAY THEN 0
+                ELSE 1
+            END AS new_streak
+        FROM ordered_days
+    ),
+
+    -- 4. Assign streak group id
+    streak_groups AS (
+        SELECT
+            activity_date
+            ,SUM(new_streak) OVER (ORDER BY activity_date) AS streak_id
+        FROM streak_flags
+    ),
+
+    -- 5. Count days per streak
+    streak_lengths AS (
+        SELECT
+            streak_id
+            ,COUNT(*) AS streak_length
+            ,MIN(activity_date) AS streak_start
+            ,MAX(activity_date) AS streak_end
+        FROM streak_groups
+        GROUP BY streak_id
+    )
+
+    -- 6. Max streak and when
+    SELECT
+        MAX(streak_length) AS max_activity_streak_days
+        ,streak_start
+        ,streak_end
+    FROM streak_lengths
+    WHERE streak_length =
+        (SELECT MAX(streak_length)
+        FROM streak_lengths)
+    GROUP BY streak_id,streak_start,streak_end
+'''
+
+# How many miles of each activity type did I do in 2025?
+report_queries["miles_by_type"] = f'''
+            SELECT type, round(sum(distance_miles),2) AS total_miles
+            FROM staging
+            WHERE {period_key_filter}
+            GROUP BY type
+            HAVING total_miles > 0
+            ORDER BY total_miles DESC
+           '''
+
+# How many runs did I do in 2025?
+# Per month and grand total
+report_queries["runs_per_month"] = f'''
+           WITH {months_sql}
+           , monthly AS (
+                SELECT m.start_date_local_yyyy_mm, count(r.id) AS total_runs
+                FROM months m
+                LEFT JOIN runs_in_2025 r ON r.date_key // 100 = m.month_key
+                GROUP BY m.start_date_local_yyyy_mm
+                ORDER BY m.start_date_local_yyyy_mm
+            )
+            , total AS (
+                SELECT 'Grand total', count(*) AS total_runs
+                FROM runs_in_2025
+            )
+            , monthly_avg AS
+                (
+                SELECT 'Monthly average',round(total_runs/{period_months_sql},0)
+                FROM total
+                )
+            SELECT * FROM monthly
+            UNION ALL
+            SELECT * FROM total
+            UNION ALL
+            SELECT *
+            FROM monthly_avg
+           '''
+
+# How many of each activity type did I do in 2025?
+report_queries["activities_by_type"] = f'''
+            SELECT type,count(*) AS activity_count
+            FROM staging
+            WHERE {period_key_filter}
+            GROUP BY type
+            ORDER BY activity_count DESC
+           '''
+
+# How did moving time differ from activity time in 2025?
+report_queries["moving_vs_elapsed_time"] = '''
+            SELECT round(sum(moving_time_hrs),2) AS total_moving_time_hrs
+                ,round(sum(elapsed_time_hrs),2) AS total_elapsed_time_hrs
+                ,concat(round((total_moving_time_hrs/total_elapsed_time_hrs)*100,2),'%') as pct_moving_time
+            FROM runs_in_2025
+           '''
+
+# How much did these metrics change YoY?
+# 2023-2025 metrics
+report_queries["yoy_basic"] = '''
+        SELECT
+            d.year
+            -- Total distance
+            ,round(sum(distance_miles),2) AS total_miles
+            -- Number of runs
+            ,count(*) AS total_runs
+            -- Total elevation gain
+            ,round(sum(total_elevation_gain_feet),2) AS total_elevation_gain_feet
+            -- Total moving time
+            ,round(sum(moving_time_hrs),2) AS total_moving_time_hrs
+        FROM staging s
+        JOIN dim_date d USING (date_key)
+        WHERE d.year > 2022
+            AND s.type = 'Run'
+        GROUP BY d.year
+        ORDER BY d.year
+        '''
+
+# YoY change
+report_queries["yoy_changes"] = yoy_sql
+report_queries["yoy_pct_change_formatted"] = format_yoy_sql
+
+# What activity had the fastest average pace?
+report_queries["fastest_run"] = '''
+        SELECT name
+            ,date(start_date_local) AS start_date
+            ,average_pace_mins_per_mile
+            ,distance_miles
+            ,kudos_count
+        FROM runs_in_2025
+        WHERE average_pace_mins_per_mile =
+            (SELECT MIN(average_pace_mins_per_mile)
+            FROM runs_in_2025
+            )
+        '''
+
+# What x activities had the fastest average pace?
+report_queries["top_pace_runs"] = f'''
+    WITH ranked_runs AS (
+        SELECT
+            name
+            ,DATE(start_date_local) AS start_date_local
+            ,average_pace_mins_per_mile
+            ,distance_miles
+            ,kudos_count
+            ,RANK() OVER (
+                ORDER BY average_pace_mins_per_mile ASC
+            ) AS pace_rank
+        FROM runs_in_2025
+    )
+    SELECT
+        name
+        ,start_date_local
+        ,average_pace_mins_per_mile
+        ,distance_miles
+        ,kudos_count
+    FROM ranked_runs
+    WHERE pace_rank <= {x}
+    ORDER BY pace_rank
+'''
+
+# What distance did I run on average?
+report_queries["average_distance"] = '''
+        SELECT ROUND(AVG(distance_miles),2)
+        FROM runs_in_2025
+        '''
+
+# How did average distance change over each quarter?
+report_queries["quarterly_average_distance"] = f'''
+        WITH {quarters_sql}
+        SELECT q.quarter, ROUND(AVG(r.distance_miles),2) AS avg_distance_miles
+        FROM quarters q
+        LEFT JOIN (
+            SELECT d.quarter_key, r.distance_miles
+            FROM runs_in_2025 r
+            JOIN dim_date d USING (date_key)
+        ) r USING (quarter_key)
+        GROUP BY q.quarter
+        ORDER BY q.quarter
+        '''
+
+# What months did I run the most and which did I run the least in terms of mileage?
+report_queries["most_and_least_miles_months"] = f'''
+           WITH {months_sql}
+           , monthly AS (
+                SELECT m.start_date_local_yyyy_mm, round(coalesce(sum(r.distance_miles),0),2) as total_miles_running
+                FROM months m
+                LEFT JOIN runs_in_2025 r ON r.date_key // 100 = m.month_key
+                GROUP BY m.start_date_local_yyyy_mm
+                ORDER BY m.start_date_local_yyyy_mm
+            )
+            , maximum AS (
+                SELECT *
+                FROM monthly
+                ORDER BY total_miles_running DESC
+                LIMIT 1
+            )
+            , minimum AS (
+                SELECT *
+                FROM monthly
+                ORDER BY total_miles_running ASC
+                LIMIT 1
+            )
+            SELECT * FROM maximum
+            UNION ALL
+            SELECT * FROM minimum
+            '''
+
+# Top y longest runs in terms of distance
+report_queries["longest_runs"] = f'''
+    WITH ranked_runs AS (
+        SELECT
+            name
+            ,DATE(start_date_local) AS start_date_local
+            ,distance_miles
+            ,average_pace_mins_per_mile
+            ,kudos_count
+            ,RANK() OVER (
+                ORDER BY distance_miles DESC
+            ) AS distance_rank
+        FROM runs_in_2025
+    )
+    SELECT
+        name
+        ,start_date_local
+        ,distance_miles
+        ,average_pace_mins_per_mile
+        ,kudos_count
+    FROM ranked_runs
+    WHERE distance_rank <= {y}
+    ORDER BY distance_rank
+    '''
+
+# Distance histogram
+report_queries["distance_histogram"] = '''
+    SELECT DISTINCT(ROUND(distance_miles,0)) AS nearest_whole_mile, COUNT(*) AS frequency
+    FROM runs_in_2025
+    GROUP BY ALL
+    ORDER BY COUNT(*) DESC
+    '''
+# %%
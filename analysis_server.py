@@ -0,0 +1,221 @@
+#%%
+import json
+import time
+import logging
+import threading
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import duckdb
+import my_utils
+import analysis_queries
+import routes
+import snapshots
+import strava_report
+
+#%%
+default_host = "127.0.0.1"
+default_port = 8765
+# How often (seconds) to look for a newly published snapshot
+default_poll_secs = 2.0
+
+# Named questions the server answers, on top of ad hoc SQL
+server_queries = dict(analysis_queries.report_queries, route_pace_trends=routes.route_pace_trends_sql)
+# Tables copied into memory: what the named questions read, plus the per-activity and daily tables
+# worth asking ad hoc. GPS point streams, route shapes and raw detail payloads stay out of the copy.
+served_tables = [
+    "staging", "runs_in_2025", "dim_date", "raw_activities", "dataset_load", "activity_changes"
+    , "daily_training_load", "fitness_thresholds", "activity_stress", "fitness_daily"
+    , "gear_cache", "gear_counters", "pace_index_entries", "activity_routes", "regions", "activity_regions"
+    , "activity_splits", "activity_laps", "activity_best_efforts"
+]
+
+
+#%%
+class WarmDatabase:
+    # The published snapshot's served tables copied into an in-memory DuckDB, answers memoized until the next publish.
+    # A reload builds the new copy on the side and swaps it in, requests in flight finish on the old one.
+    def __init__(self, queries: dict = None):
+        self.queries = queries if queries is not None else server_queries
+        self.lock = threading.Lock()
+        self.con = None
+        self.snapshot_path = None
+        self.loaded_at = None
+        self.results = {}
+
+    def load(self, snapshot_path: str):
+        logging.info(f"Loading snapshot into memory: {snapshot_path}")
+        start = time.perf_counter()
+        con = duckdb.connect()
+        # ATTACH takes no parameters, so the path is quoted here
+        quoted_path = snapshot_path.replace("'", "''")
+        con.execute(f"ATTACH '{quoted_path}' AS snapshot (READ_ONLY)")
+        table_names = [row[0] for row in con.execute('''
+            SELECT table_name FROM duckdb_tables()
+            WHERE database_name = 'snapshot' AND schema_name = 'main' AND list_contains(?, table_name)
+        ''', [served_tables]).fetchall()]
+        for table_name in table_names:
+            con.execute(f'CREATE TABLE "{table_name}" AS SELECT * FROM snapshot."{table_name}"')
+        con.execute("DETACH snapshot")
+        # Everything is in memory now: no file access from here on, and no query can turn it back on
+        con.execute("SET enable_external_access = false")
+        con.execute("SET lock_configuration = true")
+
+        with self.lock:
+            self.con, self.snapshot_path, self.results = con, snapshot_path, {}
+            self.loaded_at = my_utils.get_today_as_timestamp().strftime("%Y-%m-%d %H:%M:%S")
+        logging.info(f"Loaded {len(table_names)} tables in {time.perf_counter() - start:.3f}s")
+
+    def reload_if_published(self):
+        snapshot_path = snapshots.get_current_snapshot_path()
+        if snapshot_path and snapshot_path != self.snapshot_path:
+            self.load(snapshot_path)
+            return(True)
+        return(False)
+
+    def run_query(self, name: str):
+        with self.lock:
+            con, snapshot_path, results = self.con, self.snapshot_path, self.results
+        if name in results:
+            return(dict(results[name], secs=0.0, cached=True))
+        result = strava_report.run_named_query(con, name, self.queries[name])
+        # Only keep it if no reload happened meanwhile
+        with self.lock:
+            if self.snapshot_path == snapshot_path:
+                self.results[name] = result
+        return(result)
+
+    def run_sql(self, sql: str, params: list = None):
+        with self.lock:
+            con = self.con
+        # Ad hoc SQL is for reading: one SELECT, nothing that changes the shared copy
+        statements = con.extract_statements(sql)
+        if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+            raise ValueError("only a single SELECT statement is allowed")
+        cursor = con.cursor()
+        start = time.perf_counter()
+        try:
+            cursor.execute(sql, params or [])
+            columns = [col[0] for col in cursor.description] if cursor.description else []
+            rows = cursor.fetchall() if cursor.description else []
+        finally:
+            cursor.close()
+        return({"name": "sql", "columns": columns, "rows": rows, "secs": time.perf_counter() - start, "cached": False})
+
+
+def watch_snapshots(database: WarmDatabase, poll_secs: float, stop: threading.Event):
+    while not stop.wait(poll_secs):
+        try:
+            database.reload_if_published()
+        except Exception as e:
+            # Keep serving the current copy, try again on the next poll
+            logging.error(f"Snapshot reload failed: {e}")
+
+
+#%%
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+    # GET /health, GET /queries, GET /query/<name>, POST /sql {"sql": ..., "params": [...]} (a single SELECT)
+    database = None
+
+    def send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_result(self, result: dict):
+        self.send_json(200, {"name": result["name"], "secs": result["secs"], "cached": result["cached"]
+                             , "snapshot": self.database.snapshot_path, "columns": result["columns"]
+                             , "rows": [dict(zip(result["columns"], row)) for row in result["rows"]]})
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"snapshot": self.database.snapshot_path, "loaded_at": self.database.loaded_at})
+        elif self.path == "/queries":
+            self.send_json(200, {"queries": list(self.database.queries)})
+        elif self.path.startswith("/query/"):
+            name = self.path[len("/query/"):]
+            if name not in self.database.queries:
+                self.send_json(404, {"error": f"Unknown query: {name}"})
+                return
+            try:
+                self.send_result(self.database.run_query(name))
+            except duckdb.Error as e:
+                self.send_json(400, {"error": str(e)})
+        else:
+            self.send_json(404, {"error": f"Unknown path: {self.path}"})
+
+    def is_foreign_origin(self):
+        # Browsers send an Origin with every POST; only pages served from this server may post SQL
+        origin = self.headers.get("Origin")
+        if origin is None:
+            return(False)
+        port = self.server.server_address[1]
+        return(origin not in {f"http://{host}:{port}" for host in (self.server.server_address[0], "127.0.0.1", "localhost")})
+
+    def do_POST(self):
+        if self.path != "/sql":
+            self.send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+        if self.is_foreign_origin():
+            self.send_json(403, {"error": "Cross-origin requests are not allowed"})
+            return
+        # A form or text/plain post needs no CORS preflight, JSON does
+        if self.headers.get("Content-Type", "").split(";")[0].strip() != "application/json":
+            self.send_json(415, {"error": "Content-Type must be application/json"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            self.send_result(self.database.run_sql(request["sql"], request.get("params")))
+        except (ValueError, KeyError) as e:
+            self.send_json(400, {"error": f"Bad request: {e}"})
+        except duckdb.Error as e:
+            self.send_json(400, {"error": str(e)})
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} {format % args}")
+
+
+#%%
+def serve(host: str = default_host, port: int = default_port, poll_secs: float = default_poll_secs):
+    logging.info("Starting the serve() function")
+
+    snapshot_path = snapshots.get_current_snapshot_path()
+    if snapshot_path is None:
+        logging.error("No published snapshot yet, run data_load first")
+        raise FileNotFoundError("No published snapshot in the snapshot directory")
+
+    database = WarmDatabase()
+    database.load(snapshot_path)
+    stop = threading.Event()
+    threading.Thread(target=watch_snapshots, args=(database, poll_secs, stop), daemon=True).start()
+
+    AnalysisRequestHandler.database = database
+    server = ThreadingHTTPServer((host, port), AnalysisRequestHandler)
+    logging.info(f"Analysis server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        stop.set()
+        server.server_close()
+        logging.info("serve() function completed")
+
+
+def ask(query: str, params: list = None, host: str = default_host, port: int = default_port):
+    # From a notebook: a name runs that question, anything else is sent as SQL
+    url = f"http://{host}:{port}"
+    if query in server_queries:
+        request = urllib.request.Request(f"{url}/query/{query}")
+    else:
+        request = urllib.request.Request(f"{url}/sql", data=json.dumps({"sql": query, "params": params or []}).encode("utf-8")
+                                         , headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return(json.load(response))
+
+
+#%%
+if __name__ == "__main__":
+    init_paths = my_utils.initialize_paths("logs", "strava_data", "analysis_server")
+    my_utils.setup_logging(init_paths["log_file_path"])
+    serve()
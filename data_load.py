@@ -1,5 +1,17 @@
 #%%
+import os
 import my_utils
+import analysis_queries
+import training_load
+import fitness_model
+import gear
+import enrichment
+import pace_index
+import routes
+import regions
+import export_import
+import reconcile
+import snapshots
 import logging
 from jinja2 import Template
 
@@ -10,9 +22,55 @@ init_paths = my_utils.initialize_paths("logs", "strava_data", "strava_export")
 my_utils.setup_logging(init_paths["log_file_path"])
 logging.info("Starting Strava Analysis Pipeline")
 logging.info(f"Log deposited into: {init_paths['log_file_path']}")
-logging.info(f"Data deposited into: {init_paths['csv_file_path']}")
+logging.info(f"Data deposited into: {init_paths['parquet_file_path']}")
 
 #%%
-# Get the data
-data = my_utils.upload_data_to_duckdb(my_utils.download_data_from_strava(init_paths['csv_file_path']))
+# Get the data into the next snapshot, readers stay on the current one until it is published
+con, snapshot = snapshots.begin_snapshot()
+# Onboarding and backfills load Strava's account export archive instead of paging the API
+export_zip_path = os.getenv("STRAVA_EXPORT_ZIP")
+# Otherwise a sync reconciles the local history with Strava; STRAVA_FULL_RELOAD downloads everything again
+edited_ids = []
+has_local_history = reconcile.has_local_history(con)
+if has_local_history and not export_zip_path and not os.getenv("STRAVA_FULL_RELOAD"):
+    activities, changes = reconcile.reconcile_activities(con, init_paths['parquet_file_path'])
+    edited_ids = changes["edited"]
+else:
+    if export_zip_path:
+        activities = export_import.import_strava_export(export_zip_path, init_paths['parquet_file_path'], con)
+    else:
+        activities = my_utils.download_data_from_strava(init_paths['parquet_file_path'])
+    # The derived tables only ever append, what the new load deleted or changed is taken back first
+    if has_local_history:
+        edited_ids = reconcile.forget_replaced_history(con, activities)["edited"]
+my_utils.upload_data_to_duckdb(activities, con)
+
+#%%
+# Build the staging tables and extend the derived series
+analysis_queries.build_staging_tables(con)
+training_load.update_daily_training_load(con)
+fitness_model.update_fitness(con)
+gear.resolve_gear(con)
+gear_alerts = gear.update_gear_counters(con)
+pace_ranks = pace_index.update_pace_index(con, edited_ids=edited_ids)
+routes.update_activity_routes(con)
+regions.update_activity_regions(con)
+
+#%%
+# Publish the sync right away, readers don't wait for enrichment
+snapshots.publish_snapshot(con, snapshot)
+
+#%%
+# Fetch activity details (splits, laps, best efforts) within today's share of the rate limit.
+# It can wait out rate limit windows, so it builds a follow-up snapshot of its own.
+# An archive import stays offline, the next API sync picks the queue up.
+if not export_zip_path:
+    con, snapshot = snapshots.begin_snapshot()
+    enrichment.run_enrichment(con)
+    snapshots.publish_snapshot(con, snapshot)
+
+#%%
+# Read back the published snapshot like every other reader
+con = snapshots.connect_to_current_snapshot()
+data = con.table("raw_activities")
 logging.info("Strava Analysis Pipeline completed")
\ No newline at end of file
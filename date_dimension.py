@@ -0,0 +1,46 @@
+#%%
+import logging
+
+#%%
+# One row per calendar day, keyed by an integer yyyymmdd that activity rows carry as date_key
+create_date_dimension_sql = '''
+    CREATE OR REPLACE TABLE dim_date AS
+    WITH days AS (
+        SELECT unnest(generate_series(?::DATE, ?::DATE, INTERVAL 1 DAY))::DATE AS calendar_date
+    )
+    SELECT
+        CAST(year(calendar_date) * 10000 + month(calendar_date) * 100 + day(calendar_date) AS INTEGER) AS date_key
+        ,calendar_date
+        ,year(calendar_date) AS year
+        ,quarter(calendar_date) AS quarter
+        ,month(calendar_date) AS month
+        ,CAST(year(calendar_date) * 10 + quarter(calendar_date) AS INTEGER) AS quarter_key
+        ,CAST(year(calendar_date) * 100 + month(calendar_date) AS INTEGER) AS month_key
+        ,strftime(calendar_date, '%Y-%m') AS yyyy_mm
+        ,isoyear(calendar_date) AS iso_year
+        ,week(calendar_date) AS iso_week
+        ,CAST(isoyear(calendar_date) * 100 + week(calendar_date) AS INTEGER) AS iso_week_key
+        ,date_trunc('week', calendar_date)::DATE AS week_start
+        ,isodow(calendar_date) AS day_of_week
+        ,day(last_day(calendar_date)) AS days_in_month
+        ,datediff('day', date_trunc('quarter', calendar_date), date_trunc('quarter', calendar_date) + INTERVAL 3 MONTH) AS days_in_quarter
+        ,datediff('day', date_trunc('year', calendar_date), date_trunc('year', calendar_date) + INTERVAL 1 YEAR) AS days_in_year
+    FROM days
+    ORDER BY date_key
+'''
+
+
+def create_date_dimension(con, source_table: str = "raw_activities"):
+    logging.info("Starting the create_date_dimension() function")
+
+    # Whole years, from the first activity through the end of the current year
+    start_date, end_date = con.execute(f'''
+        SELECT
+            date_trunc('year', coalesce(min(start_date_local)::DATE, current_date))::DATE
+            ,(date_trunc('year', greatest(coalesce(max(start_date_local)::DATE, current_date), current_date)) + INTERVAL 1 YEAR - INTERVAL 1 DAY)::DATE
+        FROM {source_table}
+    ''').fetchone()
+    con.execute(create_date_dimension_sql, [start_date, end_date])
+
+    logging.info(f"dim_date covers {start_date} to {end_date}")
+    logging.info("create_date_dimension() function completed")
@@ -0,0 +1,256 @@
+#%%
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pyarrow as pa
+import my_utils
+
+#%%
+# Strava's default read limit, and the share of it enrichment may spend each day
+default_daily_limit = 1000
+default_budget_share = 0.5
+default_concurrency = 4
+# Failures an activity may rack up before it stops being retried (it stays queued with its last status)
+max_attempts = 5
+
+create_enrichment_tables_sql = '''
+    CREATE TABLE IF NOT EXISTS enrichment_queue (
+        id BIGINT PRIMARY KEY
+        ,start_date_utc TIMESTAMPTZ
+        ,enqueued_at TIMESTAMP
+        ,attempts INTEGER
+        ,last_status_code INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS activity_details (
+        id BIGINT PRIMARY KEY
+        ,status_code INTEGER
+        ,description VARCHAR
+        ,calories DOUBLE
+        ,payload JSON
+        ,fetched_at TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS activity_splits (
+        id BIGINT
+        ,units VARCHAR
+        ,split INTEGER
+        ,distance_meters DOUBLE
+        ,elapsed_time_secs BIGINT
+        ,moving_time_secs BIGINT
+        ,elevation_difference_meters DOUBLE
+        ,average_speed DOUBLE
+        ,average_heartrate DOUBLE
+        ,pace_zone INTEGER
+        ,PRIMARY KEY (id, units, split)
+    );
+    CREATE TABLE IF NOT EXISTS activity_laps (
+        id BIGINT
+        ,lap_index INTEGER
+        ,lap_id BIGINT
+        ,name VARCHAR
+        ,start_date_local TIMESTAMP
+        ,distance_meters DOUBLE
+        ,elapsed_time_secs BIGINT
+        ,moving_time_secs BIGINT
+        ,total_elevation_gain_meters DOUBLE
+        ,average_speed DOUBLE
+        ,max_speed DOUBLE
+        ,average_heartrate DOUBLE
+        ,max_heartrate DOUBLE
+        ,average_cadence DOUBLE
+        ,average_watts DOUBLE
+        ,PRIMARY KEY (id, lap_index)
+    );
+    CREATE TABLE IF NOT EXISTS activity_best_efforts (
+        id BIGINT
+        ,name VARCHAR
+        ,distance_meters DOUBLE
+        ,elapsed_time_secs BIGINT
+        ,moving_time_secs BIGINT
+        ,pr_rank INTEGER
+        ,PRIMARY KEY (id, name)
+    );
+    CREATE TABLE IF NOT EXISTS enrichment_usage (
+        usage_date DATE PRIMARY KEY
+        ,requests INTEGER
+    );
+'''
+
+split_schema = pa.schema([
+    ("id", pa.int64()), ("units", pa.string()), ("split", pa.int32()), ("distance_meters", pa.float64())
+    , ("elapsed_time_secs", pa.int64()), ("moving_time_secs", pa.int64()), ("elevation_difference_meters", pa.float64())
+    , ("average_speed", pa.float64()), ("average_heartrate", pa.float64()), ("pace_zone", pa.int32())
+])
+lap_schema = pa.schema([
+    ("id", pa.int64()), ("lap_index", pa.int32()), ("lap_id", pa.int64()), ("name", pa.string())
+    , ("start_date_local", pa.string()), ("distance_meters", pa.float64()), ("elapsed_time_secs", pa.int64())
+    , ("moving_time_secs", pa.int64()), ("total_elevation_gain_meters", pa.float64()), ("average_speed", pa.float64())
+    , ("max_speed", pa.float64()), ("average_heartrate", pa.float64()), ("max_heartrate", pa.float64())
+    , ("average_cadence", pa.float64()), ("average_watts", pa.float64())
+])
+best_effort_schema = pa.schema([
+    ("id", pa.int64()), ("name", pa.string()), ("distance_meters", pa.float64())
+    , ("elapsed_time_secs", pa.int64()), ("moving_time_secs", pa.int64()), ("pr_rank", pa.int32())
+])
+
+
+#%%
+def enqueue_missing_details(con):
+    # Activities with no cached details and not already waiting
+    con.execute(create_enrichment_tables_sql)
+    count = con.execute('''
+        INSERT INTO enrichment_queue
+        SELECT id, start_date_utc, now(), 0, NULL
+        FROM staging
+        WHERE id NOT IN (SELECT id FROM activity_details)
+            AND id NOT IN (SELECT id FROM enrichment_queue)
+    ''').fetchone()[0]
+    logging.info(f"Queued {count} activities for enrichment")
+
+    return(count)
+
+
+def get_remaining_budget(con, daily_limit: int, budget_share: float):
+    used = con.execute('''
+        SELECT coalesce(max(requests), 0) FROM enrichment_usage WHERE usage_date = current_date
+    ''').fetchone()[0]
+    remaining = max(int(daily_limit * budget_share) - used, 0)
+    return(remaining)
+
+
+def record_usage(con, requests_made: int):
+    con.execute('''
+        INSERT INTO enrichment_usage VALUES (current_date, ?)
+        ON CONFLICT (usage_date) DO UPDATE SET requests = enrichment_usage.requests + excluded.requests
+    ''', [requests_made])
+
+
+def fetch_activity_details(activity_id: int, headers: dict, request_counter=None
+                           , details_url: str = "https://www.strava.com/api/v3/activities/{activity_id}"):
+    # No retries here beyond the transient ones, a failure just stays in the queue
+    response = my_utils.request_with_retry("GET", details_url.format(activity_id=activity_id), headers=headers
+                                           , params={"include_all_efforts": "false"}, max_retries=2
+                                           , request_counter=request_counter)
+    payload = response.json() if response.status_code == 200 else None
+    return({"id": activity_id, "status_code": response.status_code, "payload": payload})
+
+
+#%%
+def store_activity_details(con, results: list):
+    # Permanent cache first, then the typed child tables
+    splits, laps, best_efforts = [], [], []
+    for result in results:
+        payload = result["payload"] or {}
+        con.execute('''
+            INSERT OR REPLACE INTO activity_details VALUES (?, ?, ?, ?, ?, now())
+        ''', [result["id"], result["status_code"], payload.get("description"), payload.get("calories"), json.dumps(payload)])
+
+        for units in ["metric", "standard"]:
+            for s in payload.get(f"splits_{units}") or []:
+                splits.append({"id": result["id"], "units": units, "split": s.get("split"), "distance_meters": s.get("distance")
+                               , "elapsed_time_secs": s.get("elapsed_time"), "moving_time_secs": s.get("moving_time")
+                               , "elevation_difference_meters": s.get("elevation_difference"), "average_speed": s.get("average_speed")
+                               , "average_heartrate": s.get("average_heartrate"), "pace_zone": s.get("pace_zone")})
+        for i, lap in enumerate(payload.get("laps") or []):
+            laps.append({"id": result["id"], "lap_index": lap.get("lap_index", i + 1), "lap_id": lap.get("id"), "name": lap.get("name")
+                         , "start_date_local": lap.get("start_date_local"), "distance_meters": lap.get("distance")
+                         , "elapsed_time_secs": lap.get("elapsed_time"), "moving_time_secs": lap.get("moving_time")
+                         , "total_elevation_gain_meters": lap.get("total_elevation_gain"), "average_speed": lap.get("average_speed")
+                         , "max_speed": lap.get("max_speed"), "average_heartrate": lap.get("average_heartrate")
+                         , "max_heartrate": lap.get("max_heartrate"), "average_cadence": lap.get("average_cadence")
+                         , "average_watts": lap.get("average_watts")})
+        for effort in payload.get("best_efforts") or []:
+            best_efforts.append({"id": result["id"], "name": effort.get("name"), "distance_meters": effort.get("distance")
+                                 , "elapsed_time_secs": effort.get("elapsed_time"), "moving_time_secs": effort.get("moving_time")
+                                 , "pr_rank": effort.get("pr_rank")})
+
+    for table_name, rows, schema in [("activity_splits", splits, split_schema), ("activity_laps", laps, lap_schema)
+                                     , ("activity_best_efforts", best_efforts, best_effort_schema)]:
+        if rows:
+            con.register("new_rows", pa.Table.from_pylist(rows, schema=schema))
+            con.execute(f"INSERT OR REPLACE INTO {table_name} BY NAME SELECT * FROM new_rows")
+            con.unregister("new_rows")
+
+    con.execute("DELETE FROM enrichment_queue WHERE id IN (SELECT unnest(?))", [[r["id"] for r in results]])
+
+
+def run_enrichment(con, daily_limit: int = default_daily_limit, budget_share: float = default_budget_share
+                   , concurrency: int = default_concurrency):
+    logging.info("Starting the run_enrichment() function")
+
+    enqueue_missing_details(con)
+    budget = get_remaining_budget(con, daily_limit, budget_share)
+    if budget == 0:
+        logging.info("Enrichment budget for today is spent")
+        return(0)
+
+    # Most recent activities first, a transient failure doesn't send one behind the older backlog
+    activity_ids = [row[0] for row in con.execute(f'''
+        SELECT id
+        FROM enrichment_queue
+        WHERE attempts < {max_attempts}
+        ORDER BY start_date_utc DESC
+        LIMIT ?
+    ''', [budget]).fetchall()]
+    if not activity_ids:
+        logging.info("Enrichment queue is empty")
+        return(0)
+
+    headers = {"Authorization": f"Bearer {my_utils.refresh_access_token()}"}
+    done, failed = [], []
+    # Every HTTP attempt counts against the budget, an activity can take up to three with retries
+    request_counter = my_utils.RequestCounter()
+    rate_limited = False
+    limit_reached = threading.Event()
+
+    def fetch_until_limited(activity_id: int):
+        # Set by the worker that hits the limit, before it can pick up another activity;
+        # requests already in flight on the other workers still finish and are collected.
+        # Retries can use up the budget before every selected activity is sent, the rest wait for the next run
+        if limit_reached.is_set() or request_counter.count >= budget:
+            return(None)
+        try:
+            return(fetch_activity_details(activity_id, headers, request_counter))
+        except my_utils.RateLimitExceeded:
+            limit_reached.set()
+            raise
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(fetch_until_limited, activity_id): activity_id for activity_id in activity_ids}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except my_utils.RateLimitExceeded:
+                if not rate_limited:
+                    logging.error("Rate limit reached, stopping enrichment for today")
+                    rate_limited = True
+                continue
+            except Exception as e:
+                logging.error(f"Enrichment failed for {futures[future]}: {e}")
+                failed.append((futures[future], None))
+                continue
+            # Never sent, the rate limit or the budget was reached first
+            if result is None:
+                continue
+            # 200s and 404s are final answers, anything else goes back in the queue
+            if result["status_code"] in (200, 404):
+                done.append(result)
+            else:
+                failed.append((result["id"], result["status_code"]))
+
+    requests_made = request_counter.count
+    if done:
+        store_activity_details(con, done)
+    for activity_id, status_code in failed:
+        con.execute('''
+            UPDATE enrichment_queue SET attempts = attempts + 1, last_status_code = ? WHERE id = ?
+        ''', [status_code, activity_id])
+    record_usage(con, requests_made)
+
+    given_up = con.execute(f"SELECT count(*) FROM enrichment_queue WHERE attempts >= {max_attempts}").fetchone()[0]
+    logging.info(f"Enriched {len(done)} activities, {len(failed)} failed, {requests_made} requests")
+    if given_up:
+        logging.warning(f"{given_up} queued activities failed {max_attempts} times and are no longer retried")
+    logging.info("run_enrichment() function completed")
+
+    return(len(done))
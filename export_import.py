@@ -0,0 +1,337 @@
+#%%
+import io
+import os
+import csv
+import gzip
+import logging
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pyarrow as pa
+import my_utils
+
+# FIT files need fitparse, GPX and TCX only need the standard library
+try:
+    import fitparse
+except ImportError:
+    fitparse = None
+
+#%%
+# Points kept in the summary polyline built from each file, about what the API returns
+summary_polyline_points = 300
+# Activities whose streams are written per insert
+stream_batch_size = 200
+semicircles_to_degrees = 180 / 2 ** 31
+
+# Types for the API fields activities.csv never fills, anything else left empty is a measure
+empty_column_types = {
+    "device_name": pa.string(), "timezone": pa.string(), "gear_id": pa.string(), "upload_id_str": pa.string()
+    ,"workout_type": pa.int64(), "achievement_count": pa.int64(), "kudos_count": pa.int64(), "comment_count": pa.int64()
+    ,"athlete_count": pa.int64(), "photo_count": pa.int64(), "pr_count": pa.int64(), "total_photo_count": pa.int64()
+    ,"upload_id": pa.int64(), "device_watts": pa.bool_(), "display_hide_heartrate_option": pa.bool_()
+    ,"has_kudoed": pa.bool_(), "from_accepted_tag": pa.bool_()
+}
+
+stream_columns = ["time", "lat", "lng", "altitude_meters", "distance_meters", "heartrate", "cadence", "watts"]
+
+create_activity_streams_sql = '''
+    CREATE TABLE IF NOT EXISTS activity_streams (
+        id BIGINT
+        ,point_index INTEGER
+        ,time TIMESTAMP
+        ,lat DOUBLE
+        ,lng DOUBLE
+        ,altitude_meters DOUBLE
+        ,distance_meters DOUBLE
+        ,heartrate DOUBLE
+        ,cadence DOUBLE
+        ,watts DOUBLE
+    );
+'''
+
+# GPX/TCX element names (namespace stripped) to stream columns
+gpx_fields = {"ele": "altitude_meters", "time": "time", "hr": "heartrate", "cad": "cadence", "power": "watts"}
+tcx_fields = {"Time": "time", "LatitudeDegrees": "lat", "LongitudeDegrees": "lng", "AltitudeMeters": "altitude_meters"
+              , "DistanceMeters": "distance_meters", "Value": "heartrate", "Cadence": "cadence", "RunCadence": "cadence", "Watts": "watts"}
+
+
+#%%
+def to_float(value):
+    try:
+        return(float(value))
+    except (TypeError, ValueError):
+        return(None)
+
+
+def to_epoch(value):
+    # ISO text from GPX/TCX, datetimes from FIT; all UTC
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return(value.timestamp())
+
+
+def get_local_name(tag: str):
+    return(tag.rsplit("}", 1)[-1])
+
+
+def parse_xml_points(data: bytes, point_tag: str, fields: dict):
+    # Streams the XML, each track point is cleared once read
+    points = []
+    for _, element in ET.iterparse(io.BytesIO(data.lstrip()), events=("end",)):
+        if get_local_name(element.tag) != point_tag:
+            continue
+        point = {"lat": to_float(element.get("lat")), "lng": to_float(element.get("lon"))}
+        for child in element.iter():
+            column = fields.get(get_local_name(child.tag))
+            if column and child.text and child.text.strip():
+                point[column] = to_epoch(child.text) if column == "time" else to_float(child.text)
+        points.append(point)
+        element.clear()
+    return(points)
+
+
+def parse_fit_points(data: bytes):
+    if fitparse is None:
+        raise ImportError("fitparse is not installed, FIT files are skipped")
+    points = []
+    for record in fitparse.FitFile(io.BytesIO(data)).get_messages("record"):
+        values = record.get_values()
+        lat, lng = values.get("position_lat"), values.get("position_long")
+        points.append({"time": to_epoch(values["timestamp"]) if values.get("timestamp") else None
+                       , "lat": lat * semicircles_to_degrees if lat is not None else None
+                       , "lng": lng * semicircles_to_degrees if lng is not None else None
+                       , "altitude_meters": values.get("enhanced_altitude", values.get("altitude"))
+                       , "distance_meters": values.get("distance"), "heartrate": values.get("heart_rate")
+                       , "cadence": values.get("cadence"), "watts": values.get("power")})
+    return(points)
+
+
+# Each worker process opens the archive once and reads members from it in memory
+worker_archive = None
+
+
+def open_archive(zip_path: str):
+    global worker_archive
+    worker_archive = zipfile.ZipFile(zip_path)
+
+
+def parse_archive_member(activity_id: int, member: str):
+    # Runs in a worker: one activity file to columnar float arrays (NaN where a point has no value)
+    try:
+        data = worker_archive.read(member)
+        name = member.lower()
+        if name.endswith(".gz"):
+            data = gzip.decompress(data)
+            name = name[:-3]
+        if name.endswith(".gpx"):
+            points = parse_xml_points(data, "trkpt", gpx_fields)
+        elif name.endswith(".tcx"):
+            points = parse_xml_points(data, "Trackpoint", tcx_fields)
+        elif name.endswith(".fit"):
+            points = parse_fit_points(data)
+        else:
+            return({"id": activity_id, "error": f"Unsupported file type: {member}"})
+    except Exception as e:
+        return({"id": activity_id, "error": f"{member}: {e}"})
+
+    streams = {column: np.array([point.get(column) for point in points], dtype=float) for column in stream_columns}
+    return({"id": activity_id, "streams": streams})
+
+
+#%%
+def encode_polyline(points: np.ndarray):
+    # Google encoded polyline of (lat, lng) rows, 1e-5 degree precision
+    encoded = []
+    previous = np.zeros(2, dtype=np.int64)
+    for row in np.round(points * 1e5).astype(np.int64):
+        for delta in row - previous:
+            value = ~(int(delta) << 1) if delta < 0 else int(delta) << 1
+            while value >= 0x20:
+                encoded.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            encoded.append(chr(value + 63))
+        previous = row
+    return("".join(encoded))
+
+
+def get_athlete_id(archive: zipfile.ZipFile):
+    if "profile.csv" not in archive.namelist():
+        return(None)
+    with archive.open("profile.csv") as f:
+        for row in csv.DictReader(io.TextIOWrapper(f, encoding="utf-8")):
+            return(int(row["Athlete ID"]) if row.get("Athlete ID") else None)
+    return(None)
+
+
+def parse_activity_date(value: str):
+    # activities.csv dates are UTC, written like "Mar 5, 2024, 3:04:05 PM"
+    for date_format in ("%b %d, %Y, %I:%M:%S %p", "%b %d, %Y, %H:%M:%S", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return(datetime.strptime(value.strip(), date_format))
+        except ValueError:
+            continue
+    return(None)
+
+
+def row_to_activity(row: dict, athlete_id: int = None):
+    # One activities.csv row in the shape the activities API returns, so staging doesn't care where it came from.
+    # Some headers repeat (Distance in km then in meters, Elapsed Time twice); the later, raw ones win.
+    start_date = parse_activity_date(row["Activity Date"])
+    activity_type = (row.get("Activity Type") or "").replace(" ", "")
+    return({
+        "id": int(row["Activity ID"])
+        ,"athlete": {"id": athlete_id, "resource_state": 1} if athlete_id else None
+        ,"name": row.get("Activity Name")
+        ,"type": activity_type
+        ,"sport_type": activity_type
+        ,"workout_type": None
+        ,"device_name": None
+        ,"start_date": start_date
+        ,"start_date_local": start_date
+        ,"timezone": None
+        ,"achievement_count": None
+        ,"kudos_count": None
+        ,"comment_count": None
+        ,"athlete_count": None
+        ,"photo_count": None
+        ,"map": {"id": f"a{row['Activity ID']}", "summary_polyline": None, "resource_state": 2}
+        ,"manual": not row.get("Filename")
+        ,"gear_id": None
+        ,"start_latlng": []
+        ,"end_latlng": []
+        ,"distance": to_float(row.get("Distance"))
+        ,"moving_time": to_float(row.get("Moving Time"))
+        ,"elapsed_time": to_float(row.get("Elapsed Time"))
+        ,"elev_high": to_float(row.get("Elevation High"))
+        ,"elev_low": to_float(row.get("Elevation Low"))
+        ,"total_elevation_gain": to_float(row.get("Elevation Gain"))
+        ,"average_speed": to_float(row.get("Average Speed"))
+        ,"max_speed": to_float(row.get("Max Speed"))
+        ,"average_cadence": to_float(row.get("Average Cadence"))
+        ,"average_watts": to_float(row.get("Average Watts"))
+        ,"max_watts": to_float(row.get("Max Watts"))
+        ,"weighted_average_watts": to_float(row.get("Weighted Average Power"))
+        ,"device_watts": None
+        ,"kilojoules": to_float(row.get("Total Work")) / 1000 if to_float(row.get("Total Work")) else None
+        ,"has_heartrate": to_float(row.get("Average Heart Rate")) is not None
+        ,"average_heartrate": to_float(row.get("Average Heart Rate"))
+        ,"max_heartrate": to_float(row.get("Max Heart Rate"))
+        ,"heartrate_opt_out": False
+        ,"display_hide_heartrate_option": None
+        ,"pr_count": None
+        ,"total_photo_count": None
+        ,"has_kudoed": None
+        ,"upload_id": None
+        ,"upload_id_str": None
+        ,"external_id": os.path.basename(row.get("Filename") or "") or None
+        ,"from_accepted_tag": None
+    })
+
+
+def apply_streams(activity: dict, streams: dict):
+    # Fill in what activities.csv doesn't have: the map, start/end points and the local time
+    has_position = ~np.isnan(streams["lat"]) & ~np.isnan(streams["lng"])
+    track = np.column_stack([streams["lat"], streams["lng"]])[has_position]
+    if len(track):
+        summary = track[np.linspace(0, len(track) - 1, min(len(track), summary_polyline_points)).astype(int)]
+        activity["map"]["summary_polyline"] = encode_polyline(summary)
+        activity["start_latlng"] = [round(float(v), 6) for v in track[0]]
+        activity["end_latlng"] = [round(float(v), 6) for v in track[-1]]
+        # The export only has UTC; local time is estimated from the start longitude (solar offset, no DST)
+        if activity["start_date"] is not None:
+            activity["start_date_local"] = activity["start_date"] + timedelta(hours=round(track[0][1] / 15))
+    altitude = streams["altitude_meters"][~np.isnan(streams["altitude_meters"])]
+    if len(altitude) and activity["elev_high"] is None:
+        activity["elev_high"], activity["elev_low"] = float(altitude.max()), float(altitude.min())
+    heartrate = streams["heartrate"][~np.isnan(streams["heartrate"])]
+    if len(heartrate) and activity["average_heartrate"] is None:
+        activity["has_heartrate"] = True
+        activity["average_heartrate"], activity["max_heartrate"] = float(heartrate.mean()), float(heartrate.max())
+
+
+def store_activity_streams(con, results: list):
+    # One row per track point, replacing whatever an earlier import stored for the same activities
+    tables = []
+    for result in results:
+        streams = result["streams"]
+        count = len(streams["time"])
+        columns = {"id": pa.array(np.full(count, result["id"], dtype=np.int64)), "point_index": pa.array(np.arange(count, dtype=np.int32))}
+        columns["time"] = pa.array((np.nan_to_num(streams["time"]) * 1e6).astype("datetime64[us]"), mask=np.isnan(streams["time"]))
+        for column in stream_columns[1:]:
+            columns[column] = pa.array(streams[column], mask=np.isnan(streams[column]))
+        tables.append(pa.table(columns))
+    if not tables:
+        return(0)
+
+    con.register("new_activity_streams", pa.concat_tables(tables))
+    con.execute("DELETE FROM activity_streams WHERE id IN (SELECT DISTINCT id FROM new_activity_streams)")
+    con.execute("INSERT INTO activity_streams BY NAME SELECT * FROM new_activity_streams")
+    con.unregister("new_activity_streams")
+    return(sum(t.num_rows for t in tables))
+
+
+#%%
+def import_strava_export(zip_path: str, export_path: str, con=None, max_workers: int = None):
+    logging.info("Starting the import_strava_export() function")
+
+    # activities.csv is read straight out of the archive, nothing is extracted to disk
+    with zipfile.ZipFile(zip_path) as archive:
+        athlete_id = get_athlete_id(archive)
+        with archive.open("activities.csv") as f:
+            reader = csv.reader(io.TextIOWrapper(f, encoding="utf-8"))
+            header = next(reader)
+            rows = [dict(zip(header, row)) for row in reader]
+        members = set(archive.namelist())
+    activities = {}
+    files = []
+    for row in rows:
+        activity = row_to_activity(row, athlete_id)
+        activities[activity["id"]] = activity
+        if row.get("Filename") in members:
+            files.append((activity["id"], row["Filename"]))
+    logging.info(f"Found {len(activities)} activities and {len(files)} activity files in {zip_path}")
+
+    if con is not None:
+        con.execute(create_activity_streams_sql)
+
+    # Files are parsed across cores; results are merged (and streams written) as they finish
+    failed, pending, stream_rows = 0, [], 0
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=open_archive, initargs=(zip_path,)) as pool:
+        futures = [pool.submit(parse_archive_member, activity_id, member) for activity_id, member in files]
+        for future in as_completed(futures):
+            result = future.result()
+            if "error" in result:
+                failed += 1
+                logging.warning(f"Could not parse activity {result['id']}: {result['error']}")
+                continue
+            apply_streams(activities[result["id"]], result["streams"])
+            # Without a database the points have nowhere to go, only the activity summaries are kept
+            if con is None:
+                continue
+            pending.append(result)
+            if len(pending) >= stream_batch_size:
+                stream_rows += store_activity_streams(con, pending)
+                pending = []
+    if con is not None:
+        stream_rows += store_activity_streams(con, pending)
+
+    # Same Arrow/Parquet path as an API download, dates as the text the API would send
+    for activity in activities.values():
+        for column in ("start_date", "start_date_local"):
+            if activity[column] is not None:
+                activity[column] = activity[column].strftime("%Y-%m-%dT%H:%M:%SZ")
+    table = my_utils.pages_to_arrow([list(activities.values())], datetime.now())
+    # A field with no values in the whole export is an Arrow null column, which DuckDB reads as INTEGER
+    for i, field in enumerate(table.schema):
+        if pa.types.is_null(field.type):
+            table = table.set_column(i, field.name, table[field.name].cast(empty_column_types.get(field.name, pa.float64())))
+    my_utils.write_parquet_atomically(table, export_path)
+
+    logging.info(f"Imported {table.num_rows} activities, {len(files) - failed} files parsed, {failed} failed, {stream_rows} stream points")
+    logging.info("import_strava_export() function completed")
+
+    return(table)
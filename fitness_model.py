@@ -0,0 +1,240 @@
+#%%
+import logging
+import pandas as pd
+import my_utils
+
+#%%
+# Time constants (days) for chronic and acute training load
+ctl_days = 42
+atl_days = 7
+
+# Defaults used when an athlete's thresholds can't be derived from their history
+default_resting_heartrate = 60
+default_stress_per_hour = 50
+# Lactate threshold as a share of max heart rate, the reference for an hour at 100 stress
+lthr_share_of_max = 0.89
+# FTP estimated from the best weighted power held for at least 20 minutes
+ftp_share_of_best_20min = 0.95
+
+create_fitness_tables_sql = '''
+    CREATE TABLE IF NOT EXISTS fitness_thresholds (
+        athlete_id BIGINT PRIMARY KEY
+        ,ftp_watts DOUBLE
+        ,max_heartrate DOUBLE
+        ,resting_heartrate DOUBLE
+    );
+    CREATE TABLE IF NOT EXISTS activity_stress (
+        id BIGINT PRIMARY KEY
+        ,athlete_id BIGINT
+        ,activity_date DATE
+        ,stress_score DOUBLE
+        ,stress_method VARCHAR
+    );
+    CREATE TABLE IF NOT EXISTS fitness_daily (
+        athlete_id BIGINT
+        ,activity_date DATE
+        ,stress_score DOUBLE
+        ,ctl DOUBLE
+        ,atl DOUBLE
+        ,tsb DOUBLE
+        ,PRIMARY KEY (athlete_id, activity_date)
+    );
+'''
+
+# Thresholds from each athlete's whole synced history, refreshed on every sync so they follow new
+# bests (or a first ride with power). Resting heart rate isn't derived, a saved value is kept.
+current_thresholds_sql = f'''
+    CREATE OR REPLACE TEMP TABLE current_thresholds AS
+    SELECT
+        athlete_id
+        ,{ftp_share_of_best_20min} * max(weighted_average_watts) FILTER (WHERE moving_time_secs >= 1200) AS ftp_watts
+        ,max(max_heartrate) AS max_heartrate
+        ,{default_resting_heartrate} AS resting_heartrate
+    FROM staging
+    WHERE athlete_id IS NOT NULL
+    GROUP BY athlete_id
+'''
+
+# Athletes whose saved thresholds no longer match, every stress score they have was scored against the old ones
+changed_thresholds_sql = '''
+    SELECT c.athlete_id
+    FROM current_thresholds c
+    JOIN fitness_thresholds t USING (athlete_id)
+    WHERE c.ftp_watts IS DISTINCT FROM t.ftp_watts
+        OR c.max_heartrate IS DISTINCT FROM t.max_heartrate
+'''
+
+upsert_thresholds_sql = '''
+    INSERT INTO fitness_thresholds
+    SELECT * FROM current_thresholds
+    ON CONFLICT (athlete_id) DO UPDATE SET
+        ftp_watts = excluded.ftp_watts
+        ,max_heartrate = excluded.max_heartrate
+'''
+
+# Stress per activity: power based when there is power (or work), heart rate TRIMP otherwise,
+# duration based as a last resort. Only activities not scored yet.
+new_activity_stress_sql = f'''
+    CREATE OR REPLACE TEMP TABLE new_activity_stress AS
+    WITH inputs AS (
+        SELECT
+            s.id
+            ,s.athlete_id
+            ,date(s.start_date_local) AS activity_date
+            ,s.moving_time_secs
+            ,coalesce(s.weighted_average_watts, s.kilojoules * 1000 / nullif(s.moving_time_secs, 0)) AS power_watts
+            ,t.ftp_watts
+            ,CASE
+                WHEN s.average_heartrate > 0
+                THEN greatest(least((s.average_heartrate - t.resting_heartrate) / nullif(t.max_heartrate - t.resting_heartrate, 0), 1), 0)
+            END AS hr_reserve
+            ,({lthr_share_of_max} * t.max_heartrate - t.resting_heartrate) / nullif(t.max_heartrate - t.resting_heartrate, 0) AS lthr_reserve
+        FROM staging s
+        JOIN fitness_thresholds t ON t.athlete_id = s.athlete_id
+        WHERE s.id NOT IN (SELECT id FROM activity_stress)
+    )
+    SELECT
+        id
+        ,athlete_id
+        ,activity_date
+        ,CASE
+            WHEN power_watts > 0 AND ftp_watts > 0
+                THEN moving_time_secs * power_watts * (power_watts / ftp_watts) / (ftp_watts * 3600) * 100
+            WHEN hr_reserve IS NOT NULL AND lthr_reserve > 0
+                THEN (moving_time_secs / 60 * hr_reserve * 0.64 * exp(1.92 * hr_reserve))
+                    / (60 * lthr_reserve * 0.64 * exp(1.92 * lthr_reserve)) * 100
+            ELSE coalesce(moving_time_secs, 0) / 3600 * {default_stress_per_hour}
+        END AS stress_score
+        ,CASE
+            WHEN power_watts > 0 AND ftp_watts > 0 THEN 'power'
+            WHEN hr_reserve IS NOT NULL AND lthr_reserve > 0 THEN 'heartrate'
+            ELSE 'duration'
+        END AS stress_method
+    FROM inputs
+'''
+
+# Daily stress from each athlete's resume day through the given date, gap-filled
+daily_stress_sql = '''
+    WITH bounds AS (
+        SELECT
+            a.athlete_id
+            ,coalesce(r.resume_date, min(a.activity_date)) AS start_date
+        FROM activity_stress a
+        LEFT JOIN resume_points r ON r.athlete_id = a.athlete_id
+        GROUP BY a.athlete_id, r.resume_date
+    )
+    , spine AS (
+        SELECT
+            athlete_id
+            ,unnest(generate_series(start_date, ?::DATE, INTERVAL 1 DAY))::DATE AS activity_date
+        FROM bounds
+        WHERE start_date <= ?::DATE
+    )
+    SELECT
+        s.athlete_id
+        ,s.activity_date
+        ,coalesce(sum(a.stress_score), 0) AS stress_score
+    FROM spine s
+    LEFT JOIN activity_stress a USING (athlete_id, activity_date)
+    GROUP BY ALL
+    ORDER BY s.athlete_id, s.activity_date
+'''
+
+
+#%%
+def compute_fitness(daily: pd.DataFrame, state: pd.DataFrame):
+    # daily: athlete_id, activity_date, stress_score for the days to compute
+    # state: athlete_id, ctl, atl as of the day before each athlete's first row
+    # Each athlete's saved state is put in front of their days as a seed row, then one
+    # grouped exponentially weighted mean runs the recurrence for every athlete at once
+    seeds = daily.groupby("athlete_id", as_index=False).first()[["athlete_id"]]
+    seeds = seeds.merge(state, on="athlete_id", how="left").fillna({"ctl": 0.0, "atl": 0.0})
+    seeds["seed"] = True
+
+    frame = pd.concat([seeds, daily.assign(seed=False)], ignore_index=True)
+    frame = frame.sort_values(["athlete_id", "seed", "activity_date"], ascending=[True, False, True], kind="stable")
+
+    for column, days in [("ctl", ctl_days), ("atl", atl_days)]:
+        values = frame[column].where(frame["seed"], frame["stress_score"])
+        frame[column] = (
+            values.groupby(frame["athlete_id"])
+            .ewm(alpha=1 / days, adjust=False)
+            .mean()
+            .reset_index(level=0, drop=True)
+        )
+
+    fitness = frame[~frame["seed"]].drop(columns="seed").reset_index(drop=True)
+    fitness["tsb"] = fitness["ctl"] - fitness["atl"]
+
+    return(fitness[["athlete_id", "activity_date", "stress_score", "ctl", "atl", "tsb"]])
+
+
+#%%
+def update_fitness(con, through_date=None, full_rebuild: bool = False):
+    logging.info("Starting the update_fitness() function")
+
+    if through_date is None:
+        through_date = my_utils.get_today_as_date()
+    if full_rebuild:
+        con.execute("DROP TABLE IF EXISTS fitness_daily")
+        con.execute("DROP TABLE IF EXISTS activity_stress")
+        con.execute("DROP TABLE IF EXISTS fitness_thresholds")
+    con.execute(create_fitness_tables_sql)
+
+    con.execute(current_thresholds_sql)
+    changed_ids = [row[0] for row in con.execute(changed_thresholds_sql).fetchall()]
+    if changed_ids:
+        # Rescored from scratch, no saved day of theirs is left to resume from
+        logging.info(f"Thresholds changed for {len(changed_ids)} athletes, rescoring their history")
+        con.execute("DELETE FROM activity_stress WHERE athlete_id IN (SELECT unnest(?))", [changed_ids])
+        con.execute("DELETE FROM fitness_daily WHERE athlete_id IN (SELECT unnest(?))", [changed_ids])
+    con.execute(upsert_thresholds_sql)
+    con.execute(new_activity_stress_sql)
+    con.execute("INSERT INTO activity_stress SELECT * FROM new_activity_stress")
+
+    # Resume from the last saved day (recomputed, it may have gained activities since),
+    # or earlier if a newly synced activity lands on a day that was already filled with rest
+    con.execute('''
+        CREATE OR REPLACE TEMP TABLE resume_points AS
+        WITH saved AS (
+            SELECT athlete_id, max(activity_date) AS last_date
+            FROM fitness_daily
+            GROUP BY athlete_id
+        )
+        , synced AS (
+            SELECT athlete_id, min(activity_date) AS first_new_date
+            FROM new_activity_stress
+            GROUP BY athlete_id
+        )
+        SELECT s.athlete_id, least(s.last_date, n.first_new_date) AS resume_date
+        FROM saved s
+        LEFT JOIN synced n USING (athlete_id)
+    ''')
+    daily = con.execute(daily_stress_sql, [through_date, through_date]).df()
+    if daily.empty:
+        logging.info("No new days to compute")
+        return(0)
+
+    state = con.execute('''
+        SELECT f.athlete_id, f.ctl, f.atl
+        FROM fitness_daily f
+        JOIN resume_points r ON r.athlete_id = f.athlete_id
+        WHERE f.activity_date = r.resume_date - INTERVAL 1 DAY
+    ''').df()
+
+    fitness = compute_fitness(daily, state)
+
+    con.execute('''
+        DELETE FROM fitness_daily
+        USING resume_points r
+        WHERE fitness_daily.athlete_id = r.athlete_id
+            AND fitness_daily.activity_date >= r.resume_date
+    ''')
+    con.register("computed_fitness", fitness)
+    con.execute("INSERT INTO fitness_daily BY NAME SELECT * FROM computed_fitness")
+    con.unregister("computed_fitness")
+
+    logging.info(f"Computed {len(fitness)} days of fitness for {fitness['athlete_id'].nunique()} athletes")
+    logging.info("update_fitness() function completed")
+
+    return(len(fitness))
@@ -0,0 +1,148 @@
+#%%
+import json
+import logging
+import my_utils
+
+#%%
+miles_to_meters = 1609.34
+# Mileage (miles) at which to flag gear for retirement
+default_alert_miles = [300, 400, 500]
+
+create_gear_tables_sql = '''
+    CREATE TABLE IF NOT EXISTS gear_cache (
+        gear_id VARCHAR PRIMARY KEY
+        ,name VARCHAR
+        ,brand_name VARCHAR
+        ,model_name VARCHAR
+        ,description VARCHAR
+        ,retired BOOLEAN
+        ,status_code INTEGER
+        ,payload JSON
+        ,fetched_at TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS gear_counters (
+        gear_id VARCHAR PRIMARY KEY
+        ,distance_meters DOUBLE
+        ,moving_time_secs DOUBLE
+        ,activity_count BIGINT
+        ,updated_at TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS gear_counted_activities (
+        id BIGINT PRIMARY KEY
+        ,gear_id VARCHAR
+        ,distance_meters DOUBLE
+        ,moving_time_secs DOUBLE
+    );
+'''
+
+
+#%%
+def fetch_gear(gear_id: str, headers: dict, gear_url: str = "https://www.strava.com/api/v3/gear/{gear_id}"):
+    logging.info(f"Requesting gear {gear_id}")
+    response = my_utils.request_with_retry("GET", gear_url.format(gear_id=gear_id), headers=headers)
+
+    # A missing gear is an answer too, cache it so it isn't asked for again
+    if response.status_code in (200, 404):
+        payload = response.json() if response.status_code == 200 else {}
+        return({"status_code": response.status_code, "payload": payload})
+
+    logging.error(f"Gear API request failed for {gear_id}: {response.text}")
+    raise Exception(f"Failed to fetch gear {gear_id}.")
+
+
+def resolve_gear(con):
+    logging.info("Starting the resolve_gear() function")
+    con.execute(create_gear_tables_sql)
+
+    # Only ids never seen before go to the API
+    unknown_ids = [row[0] for row in con.execute('''
+        SELECT DISTINCT gear_id
+        FROM staging
+        WHERE gear_id IS NOT NULL
+            AND gear_id NOT IN (SELECT gear_id FROM gear_cache)
+    ''').fetchall()]
+
+    if not unknown_ids:
+        logging.info("All gear already cached")
+        return(0)
+
+    headers = {"Authorization": f"Bearer {my_utils.refresh_access_token()}"}
+    cached_count = 0
+    for gear_id in unknown_ids:
+        # A failed lookup leaves the id uncached for the next sync, it doesn't hold up this one
+        try:
+            gear = fetch_gear(gear_id, headers)
+        except my_utils.RateLimitExceeded:
+            logging.error("Rate limit reached, leaving the remaining gear for the next sync")
+            break
+        except Exception as e:
+            logging.error(f"Gear lookup failed for {gear_id}: {e}")
+            continue
+        payload = gear["payload"]
+        con.execute('''
+            INSERT INTO gear_cache
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, now())
+        ''', [gear_id, payload.get("name"), payload.get("brand_name"), payload.get("model_name")
+              , payload.get("description"), payload.get("retired"), gear["status_code"], json.dumps(payload)])
+        cached_count += 1
+
+    logging.info(f"Cached {cached_count} of {len(unknown_ids)} new gear")
+    logging.info("resolve_gear() function completed")
+
+    return(cached_count)
+
+
+#%%
+def update_gear_counters(con, alert_miles: list = None):
+    logging.info("Starting the update_gear_counters() function")
+    con.execute(create_gear_tables_sql)
+
+    if alert_miles is None:
+        alert_miles = default_alert_miles
+
+    # Activities not counted yet, the counters are never rebuilt from history
+    con.execute('''
+        CREATE OR REPLACE TEMP TABLE new_gear_activities AS
+        SELECT id, gear_id, coalesce(distance_meters, 0) AS distance_meters, coalesce(moving_time_secs, 0) AS moving_time_secs
+        FROM staging
+        WHERE gear_id IS NOT NULL
+            AND id NOT IN (SELECT id FROM gear_counted_activities)
+    ''')
+    con.execute('''
+        CREATE OR REPLACE TEMP TABLE gear_deltas AS
+        SELECT gear_id, sum(distance_meters) AS distance_meters, sum(moving_time_secs) AS moving_time_secs, count(*) AS activity_count
+        FROM new_gear_activities
+        GROUP BY gear_id
+    ''')
+
+    con.execute('''
+        INSERT INTO gear_counters
+        SELECT gear_id, distance_meters, moving_time_secs, activity_count, now()
+        FROM gear_deltas
+        ON CONFLICT (gear_id) DO UPDATE SET
+            distance_meters = gear_counters.distance_meters + excluded.distance_meters
+            ,moving_time_secs = gear_counters.moving_time_secs + excluded.moving_time_secs
+            ,activity_count = gear_counters.activity_count + excluded.activity_count
+            ,updated_at = excluded.updated_at
+    ''')
+    con.execute("INSERT INTO gear_counted_activities SELECT * FROM new_gear_activities")
+
+    # Thresholds crossed by this sync
+    alerts = []
+    rows = con.execute('''
+        SELECT c.gear_id, g.name, c.distance_meters - d.distance_meters AS before_meters, c.distance_meters AS after_meters
+        FROM gear_deltas d
+        JOIN gear_counters c USING (gear_id)
+        LEFT JOIN gear_cache g USING (gear_id)
+    ''').fetchall()
+    for gear_id, name, before_meters, after_meters in rows:
+        for miles in sorted(alert_miles):
+            if before_meters < miles * miles_to_meters <= after_meters:
+                logging.warning(f"Gear {name or gear_id} passed {miles} miles ({round(after_meters / miles_to_meters, 2)} miles total)")
+                alerts.append({"gear_id": gear_id, "name": name, "threshold_miles": miles
+                               , "total_miles": round(after_meters / miles_to_meters, 2)})
+
+    logging.info(f"Counted {len(rows)} gear updates, {len(alerts)} alerts")
+    logging.info("update_gear_counters() function completed")
+
+    return(alerts)
@@ -1,11 +1,20 @@
 #%%
 import glob
+import json
+import time
+import random
+import shutil
+import hashlib
 import duckdb
 import os
 import logging
+import threading
 from datetime import datetime
 import requests
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
 #%%
 def get_today_as_date():
@@ -33,6 +42,83 @@ def get_specific_path(sub_path: str):
     return(specific_path)
 
 
+#%%
+# Transient failures worth retrying (rate limited or server side)
+retryable_status_codes = {429, 500, 502, 503, 504}
+# Strava's short term rate limit resets every 15 minutes
+rate_limit_window_secs = 15 * 60
+# (connect, read) seconds before a stalled request counts as failed and is retried
+request_timeout_secs = (10, 60)
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+class RequestCounter:
+    # HTTP attempts shared across worker threads, retries included
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def increment(self):
+        with self.lock:
+            self.count += 1
+
+
+def parse_rate_limit(response):
+    # X-RateLimit-Limit / X-RateLimit-Usage are "15 minute,daily" pairs
+    try:
+        limit_15min, limit_daily = [int(v) for v in response.headers["X-RateLimit-Limit"].split(",")[:2]]
+        usage_15min, usage_daily = [int(v) for v in response.headers["X-RateLimit-Usage"].split(",")[:2]]
+    except (KeyError, ValueError):
+        return(None)
+    return({"limit_15min": limit_15min, "limit_daily": limit_daily
+            , "usage_15min": usage_15min, "usage_daily": usage_daily})
+
+
+def get_retry_wait_secs(response, attempt: int, backoff_base: float, backoff_max: float):
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return(float(retry_after))
+        if response.status_code == 429:
+            # Wait for the next 15 minute window instead of hammering the limit
+            return(rate_limit_window_secs - time.time() % rate_limit_window_secs + random.uniform(0, 5))
+    # Exponential backoff with full jitter
+    return(random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt)))
+
+
+def request_with_retry(method: str, url: str, max_retries: int = 5, backoff_base: float = 2.0
+                       , backoff_max: float = 300.0, request_counter=None, **kwargs):
+    kwargs.setdefault("timeout", request_timeout_secs)
+    for attempt in range(max_retries + 1):
+        response = None
+        try:
+            if request_counter is not None:
+                request_counter.increment()
+            response = requests.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == max_retries:
+                raise
+            logging.warning(f"Request to {url} failed ({e}), retrying")
+        else:
+            if response.status_code not in retryable_status_codes:
+                return(response)
+            rate_limit = parse_rate_limit(response)
+            if response.status_code == 429 and rate_limit and rate_limit["usage_daily"] >= rate_limit["limit_daily"]:
+                # Nothing to wait for today, stop and let the next run resume
+                logging.error(f"Daily rate limit reached: {rate_limit}")
+                raise RateLimitExceeded("Strava daily rate limit reached.")
+            if attempt == max_retries:
+                return(response)
+            logging.warning(f"Request to {url} returned {response.status_code}, retrying")
+
+        wait_secs = get_retry_wait_secs(response, attempt, backoff_base, backoff_max)
+        logging.info(f"Waiting {wait_secs:.1f}s before retry {attempt + 1} of {max_retries}")
+        time.sleep(wait_secs)
+
+
 def refresh_access_token(auth_url: str= "https://www.strava.com/oauth/token"):
     logging.info("Starting the refresh_access_token() function")
     
@@ -51,7 +137,7 @@ def refresh_access_token(auth_url: str= "https://www.strava.com/oauth/token"):
         "grant_type": "refresh_token"
     }
 
-    auth_response = requests.post(auth_url, data=auth_params)
+    auth_response = request_with_retry("POST", auth_url, data=auth_params)
 
     if auth_response.status_code != 200:
         logging.error(f"Token refresh failed: {auth_response.text}")
@@ -74,18 +160,98 @@ def initialize_paths(log_dir: str, data_dir: str, filename: str):
     filename = f"{filename}_{today}"
     log_file_path = os.path.join(log_dir, filename+".log")
     csv_file_path = os.path.join(data_dir, filename+".csv")
+    parquet_file_path = os.path.join(data_dir, filename+".parquet")
 
     return({"log_file_path":log_file_path
-            , "csv_file_path":csv_file_path})
+            , "csv_file_path":csv_file_path
+            , "parquet_file_path":parquet_file_path})
 
 
 #%%
-def download_data_from_strava(csv_path: str, activities_url: str = "https://www.strava.com/api/v3/athlete/activities"):
+def get_checkpoint_dir(export_path: str):
+    # Not named after the (dated) export, so a run stopped by the daily limit resumes the next day.
+    # The manifest records the athlete, pages of another account are never mixed in.
+    checkpoint_dir = os.path.join(os.path.dirname(export_path), "checkpoints", "full_download")
+    return(checkpoint_dir)
+
+
+def write_json_atomically(obj, path: str):
+    # Unique per process, so two runs writing the same path never share a temp file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(checkpoint_dir: str):
+    # Returns the run manifest and the pages already fetched, in page order
+    manifest_path = os.path.join(checkpoint_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return(None, [])
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    pages = []
+    for page_path in sorted(glob.glob(os.path.join(checkpoint_dir, "page_*.json"))):
+        with open(page_path) as f:
+            pages.append(json.load(f))
+
+    return(manifest, pages)
+
+
+def pages_to_arrow(pages: list, loaded_date: datetime):
+    # Pages can overlap if activities were deleted mid-run
+    activities = list({activity["id"]: activity for batch in pages for activity in batch}.values())
+
+    # Nested fields (map, athlete, latlng) become Arrow structs/lists, no text round-trip.
+    # Column types are inferred per batch of 200 and promoted across batches
+    # (e.g. a column that is all null in one page and numbers in another).
+    batches = [pa.Table.from_pylist(activities[i:i + 200]) for i in range(0, len(activities), 200)]
+    if not batches:
+        return(pa.table({}))
+    table = pa.concat_tables(batches, promote_options="permissive")
+
+    # ISO dates arrive as text: start_date is UTC, start_date_local is wall-clock time
+    for column, tz in [("start_date", "UTC"), ("start_date_local", None)]:
+        if column in table.column_names:
+            parsed = pc.strptime(table[column], format="%Y-%m-%dT%H:%M:%SZ", unit="s")
+            table = table.set_column(table.column_names.index(column), column, parsed.cast(pa.timestamp("s", tz=tz)))
+
+    # add loaded date
+    table = table.append_column("loaded_date", pa.array([loaded_date] * table.num_rows, pa.timestamp("us")))
+
+    return(table)
+
+
+def write_parquet_atomically(table: pa.Table, path: str):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+
+
+def download_data_from_strava(export_path: str, activities_url: str = "https://www.strava.com/api/v3/athlete/activities"):
     logging.info("Starting the download_data_from_strava() function")
 
+    if not export_path:
+        logging.error("No export_path provided to download_data_from_strava")
+        raise ValueError("export_path is required")
+
     # Refresh access token
     access_token = refresh_access_token()
-    
+
+    # ---------------------------------------------------------
+    # Resume from checkpoint
+    # ---------------------------------------------------------
+    checkpoint_dir = get_checkpoint_dir(export_path)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    manifest, pages = load_checkpoint(checkpoint_dir)
+    if manifest is None:
+        # Pin the run to activities before its start so new uploads don't shift the pages
+        manifest = {"before": int(time.time()), "athlete_id": None}
+        write_json_atomically(manifest, os.path.join(checkpoint_dir, "manifest.json"))
+    else:
+        logging.info(f"Resuming from checkpoint with {len(pages)} pages: {checkpoint_dir}")
+
     # ---------------------------------------------------------
     # Get Activities
     # ---------------------------------------------------------
@@ -93,13 +259,12 @@ def download_data_from_strava(csv_path: str, activities_url: str = "https://www.
     headers = {"Authorization": f"Bearer {access_token}"}
 
     # Full load of all activities ever
-    all_activities = []
-    page = 1
+    page = len(pages) + 1
 
     while True:
         logging.info("Requesting page %d of activities", page)
-        params = {"page": page, "per_page": 200}  # 200 is max allowed
-        response = requests.get(activities_url, headers=headers, params=params)
+        params = {"page": page, "per_page": 200, "before": manifest["before"]}  # 200 is max allowed
+        response = request_with_retry("GET", activities_url, headers=headers, params=params)
         if response.status_code != 200:
             logging.error(f"Activities API request failed: {response.text}")
             raise Exception("Failed to fetch activities.")
@@ -108,44 +273,62 @@ def download_data_from_strava(csv_path: str, activities_url: str = "https://www.
         if not batch:
             break
 
-        all_activities.extend(batch)
+        athlete_id = (batch[0].get("athlete") or {}).get("id")
+        if manifest.get("athlete_id") is None:
+            manifest["athlete_id"] = athlete_id
+            write_json_atomically(manifest, os.path.join(checkpoint_dir, "manifest.json"))
+        elif athlete_id != manifest["athlete_id"]:
+            # The saved pages belong to another account, start over
+            logging.warning(f"Checkpoint is for athlete {manifest['athlete_id']}, not {athlete_id}, starting a new download")
+            shutil.rmtree(checkpoint_dir)
+            os.makedirs(checkpoint_dir)
+            manifest = {"before": int(time.time()), "athlete_id": None}
+            write_json_atomically(manifest, os.path.join(checkpoint_dir, "manifest.json"))
+            pages, page = [], 1
+            continue
+
+        # Every completed page is kept, so a failure later on doesn't lose it
+        write_json_atomically(batch, os.path.join(checkpoint_dir, f"page_{page:05d}.json"))
+        pages.append(batch)
         page += 1
 
-    logging.info(f"Fetched {len(all_activities)} activities.")
-
     # ---------------------------------------------------------
-    # Save Activities to CSV
+    # Save Activities to Parquet
     # ---------------------------------------------------------
-    # convert to data frame
-    df = pd.DataFrame(all_activities)
-    # add loaded date in PST
-    df["loaded_date"] = get_today_as_timestamp()
-    # convert to csv
-    if not csv_path:
-        logging.error("No csv_path provided to download_data_from_strava")
-        raise ValueError("csv_path is required")
-    df.to_csv(csv_path, index=False)
+    # Straight from the JSON pages to Arrow, pandas is only needed by callers who want it
+    table = pages_to_arrow(pages, datetime.now())
+    logging.info(f"Fetched {table.num_rows} activities.")
+    write_parquet_atomically(table, export_path)
+
+    # The export is complete, the checkpoint is no longer needed
+    shutil.rmtree(checkpoint_dir)
 
     logging.info(f"download_data_from_strava() function completed")
 
-    return(df)
+    return(table)
 
 #%%
-def upload_data_to_duckdb(df: pd.DataFrame):
-    logging.info(f"Starting upload_data_to_duckdb() function")
-    
-    # Get all the files in the "data" directory
-    data_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'strava_data'))
-    csv_files = sorted(glob.glob(os.path.join(data_dir, '*.csv')))
-    logging.info(f"Found CSV files, getting the latest file from data directory: {data_dir}")
+def connect_to_duckdb(db_path: str = None, read_only: bool = False):
+    # Readers open published snapshots read only (see snapshots.py), the writer opens the next one
+    if not db_path:
+        db_path = get_specific_path(os.path.join("strava_data", "strava.duckdb"))
+    logging.info(f"Connecting to DuckDB database: {db_path}")
+    con = duckdb.connect(db_path, read_only=read_only)
+    return(con)
+
+
+def get_latest_export_file(data_dir: str):
+    # Parquet exports from the API, CSV exports from older runs
+    export_files = sorted(glob.glob(os.path.join(data_dir, '*.parquet')) + glob.glob(os.path.join(data_dir, '*.csv')))
+    logging.info(f"Found export files, getting the latest file from data directory: {data_dir}")
 
     # Get the latest file based on filename date
     file_info = []  # list of tuples: (date, filepath)
 
-    for f in csv_files:
+    for f in export_files:
         filename = os.path.basename(f)
         # Remove prefix and extension, then take the first part as the date
-        fn = filename.replace("strava_export_", "").replace(".csv", "")
+        fn = os.path.splitext(filename.replace("strava_export_", ""))[0]
         date_str = fn.split("_")[0]
 
         try:
@@ -158,8 +341,8 @@ def upload_data_to_duckdb(df: pd.DataFrame):
 
     # If no valid files found
     if not file_info:
-        logging.error("No valid CSV files found")
-        raise FileNotFoundError("No valid CSV files found in data directory")
+        logging.error("No valid export files found")
+        raise FileNotFoundError("No valid export files found in data directory")
 
     # Find latest date overall
     latest_date = max(date for date, _ in file_info)
@@ -168,9 +351,47 @@ def upload_data_to_duckdb(df: pd.DataFrame):
     # If multiple files exist for the same date, choose the most recently modified file
     latest_file = max(candidate_files, key=os.path.getmtime)
 
-    ddb = duckdb.read_csv(latest_file)
-    logging.info(f"Reading the latest CSV file read into DuckDB: {latest_file}")
+    return(latest_file)
+
+
+def get_file_fingerprint(file_path: str):
+    # Path, size and mtime change whenever a new export is written
+    stat = os.stat(file_path)
+    fingerprint = hashlib.sha256(f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+    return(fingerprint)
+
+
+def get_dataset_fingerprint(con):
+    # Fingerprint of whatever load is currently in raw_activities
+    fingerprint = con.execute("SELECT fingerprint FROM dataset_load").fetchone()[0]
+    return(fingerprint)
+
+
+def upload_data_to_duckdb(table: pa.Table = None, con=None):
+    logging.info(f"Starting upload_data_to_duckdb() function")
+
+    # Get all the files in the "data" directory
+    data_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'strava_data'))
+    latest_file = get_latest_export_file(data_dir)
+
+    if con is None:
+        con = connect_to_duckdb()
+
+    # Materialize the raw activities so every cursor on the database can read them
+    if table is not None:
+        # Freshly downloaded, DuckDB scans the Arrow buffers directly
+        con.register("downloaded_activities", table)
+        con.execute("CREATE OR REPLACE TABLE raw_activities AS SELECT * FROM downloaded_activities")
+        con.unregister("downloaded_activities")
+    elif latest_file.endswith(".parquet"):
+        con.execute("CREATE OR REPLACE TABLE raw_activities AS SELECT * FROM read_parquet(?)", [latest_file])
+    else:
+        con.execute("CREATE OR REPLACE TABLE raw_activities AS SELECT * FROM read_csv(?)", [latest_file])
+    con.execute("CREATE OR REPLACE TABLE dataset_load AS SELECT ? AS source_file, ? AS fingerprint, now() AS loaded_at"
+                , [latest_file, get_file_fingerprint(latest_file)])
+    ddb = con.table("raw_activities")
+    logging.info(f"Reading the latest export file read into DuckDB: {latest_file}")
     logging.info(f"upload_data_to_duckdb() function completed")
-    
+
     return(ddb)
 # %%
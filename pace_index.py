@@ -0,0 +1,137 @@
+#%%
+import math
+import bisect
+import logging
+import pyarrow as pa
+
+#%%
+create_pace_index_tables_sql = '''
+    CREATE TABLE IF NOT EXISTS pace_index_entries (
+        id BIGINT PRIMARY KEY
+        ,sport_type VARCHAR
+        ,distance_bucket INTEGER
+        ,pace DOUBLE
+    );
+    CREATE TABLE IF NOT EXISTS pace_index_state (
+        max_indexed_id BIGINT
+    );
+'''
+
+entry_schema = pa.schema([("id", pa.int64()), ("sport_type", pa.string()), ("distance_bucket", pa.int32()), ("pace", pa.float64())])
+
+
+def get_distance_bucket(distance_miles: float):
+    # Same buckets as the distance histogram: nearest whole mile, halves rounded up like SQL ROUND
+    return(int(math.floor(distance_miles + 0.5)))
+
+
+class PaceIndex:
+    # Sorted paces per (sport_type, distance bucket). Rank and percentile are a binary
+    # search, histograms are bucket sizes, neither touches the activity table.
+    # Saved in the database it was built from, so readers see the index of the snapshot they opened.
+    def __init__(self, con):
+        self.con = con
+        self.buckets = {}  # (sport_type, bucket) -> sorted list of paces
+        self.entries = {}  # activity id -> (sport_type, bucket, pace)
+        self.max_indexed_id = 0
+        # Changed since the index was loaded, save() writes only these rows
+        self.added_ids, self.removed_ids = set(), set()
+
+        saved = con.execute("SELECT count(*) FROM duckdb_tables() WHERE schema_name = 'main' AND table_name = 'pace_index_entries'").fetchone()[0]
+        if saved:
+            self.max_indexed_id = con.execute("SELECT coalesce(max(max_indexed_id), 0) FROM pace_index_state").fetchone()[0]
+            for activity_id, sport_type, bucket, pace in con.execute("SELECT id, sport_type, distance_bucket, pace FROM pace_index_entries").fetchall():
+                self.entries[activity_id] = (sport_type, bucket, pace)
+                self.buckets.setdefault((sport_type, bucket), []).append(pace)
+            for paces in self.buckets.values():
+                paces.sort()
+
+    def save(self):
+        # Only the writer saves, inside the snapshot it is building
+        self.con.execute(create_pace_index_tables_sql)
+        self.con.execute("DELETE FROM pace_index_entries WHERE id IN (SELECT unnest(?))", [sorted(self.added_ids | self.removed_ids)])
+        if self.added_ids:
+            self.con.register("saved_pace_entries", pa.Table.from_pylist(
+                [{"id": activity_id, "sport_type": self.entries[activity_id][0], "distance_bucket": self.entries[activity_id][1]
+                  , "pace": self.entries[activity_id][2]} for activity_id in sorted(self.added_ids)], schema=entry_schema))
+            self.con.execute("INSERT INTO pace_index_entries SELECT * FROM saved_pace_entries")
+            self.con.unregister("saved_pace_entries")
+        self.con.execute("DELETE FROM pace_index_state")
+        self.con.execute("INSERT INTO pace_index_state VALUES (?)", [self.max_indexed_id])
+        self.added_ids, self.removed_ids = set(), set()
+
+    def add(self, activity_id: int, sport_type: str, distance_miles: float, pace: float):
+        if activity_id in self.entries:
+            return(False)
+        bucket = get_distance_bucket(distance_miles)
+        bisect.insort(self.buckets.setdefault((sport_type, bucket), []), pace)
+        self.entries[activity_id] = (sport_type, bucket, pace)
+        self.added_ids.add(activity_id)
+        self.max_indexed_id = max(self.max_indexed_id, activity_id)
+        return(True)
+
+    def remove(self, activity_id: int):
+        if activity_id not in self.entries:
+            return(False)
+        sport_type, bucket, pace = self.entries.pop(activity_id)
+        self.added_ids.discard(activity_id)
+        self.removed_ids.add(activity_id)
+        paces = self.buckets[(sport_type, bucket)]
+        del paces[bisect.bisect_left(paces, pace)]
+        return(True)
+
+    def rank(self, sport_type: str, distance_miles: float, pace: float):
+        # rank 1 is the fastest; percentile is the share of efforts this pace beats
+        paces = self.buckets.get((sport_type, get_distance_bucket(distance_miles)), [])
+        count = len(paces)
+        if count == 0:
+            return({"rank": 1, "count": 0, "percentile": None})
+        faster = bisect.bisect_left(paces, pace)
+        slower = count - bisect.bisect_right(paces, pace)
+        return({"rank": faster + 1, "count": count, "percentile": round(slower / count * 100, 1)})
+
+    def histogram(self, sport_type: str):
+        counts = {bucket: len(paces) for (sport, bucket), paces in self.buckets.items() if sport == sport_type and paces}
+        return(dict(sorted(counts.items())))
+
+    def quantile(self, sport_type: str, distance_miles: float, q: float):
+        paces = self.buckets.get((sport_type, get_distance_bucket(distance_miles)), [])
+        if not paces:
+            return(None)
+        return(paces[min(int(q * len(paces)), len(paces) - 1)])
+
+
+#%%
+def update_pace_index(con, index: PaceIndex = None, edited_ids: list = None):
+    logging.info("Starting the update_pace_index() function")
+
+    if index is None:
+        index = PaceIndex(con)
+
+    # Strava ids only go up, even for activities uploaded late, so new ones are above the watermark.
+    # Edited activities were taken out of the index by the reconciliation and go back in by id.
+    new_activities = con.execute('''
+        SELECT id, name, sport_type, distance_miles, average_pace_mins_per_mile
+        FROM staging
+        WHERE (id > ? OR list_contains(?::BIGINT[], id))
+            AND distance_miles > 0
+        ORDER BY id
+    ''', [index.max_indexed_id, edited_ids or []]).fetchall()
+
+    for activity_id, name, sport_type, distance_miles, pace in new_activities:
+        index.add(activity_id, sport_type, distance_miles, pace)
+
+    # Where each new activity lands against the whole history
+    ranks = []
+    for activity_id, name, sport_type, distance_miles, pace in new_activities:
+        rank = index.rank(sport_type, distance_miles, pace)
+        rank.update({"id": activity_id, "name": name, "sport_type": sport_type
+                     , "distance_bucket": get_distance_bucket(distance_miles), "pace": pace})
+        ranks.append(rank)
+        logging.info(f"{name}: {rank['percentile']} percentile pace of {rank['count']} {sport_type}s around {rank['distance_bucket']} miles")
+
+    index.save()
+    logging.info(f"Indexed {len(new_activities)} new activities")
+    logging.info("update_pace_index() function completed")
+
+    return(ranks)
@@ -0,0 +1,157 @@
+#%%
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+import duckdb
+import my_utils
+
+#%%
+def normalize_sql(sql: str):
+    # Comments and whitespace don't change the answer, so they shouldn't change the key
+    sql = re.sub(r"--[^\n]*", " ", sql)
+    sql = re.sub(r"\s+", " ", sql)
+    return(sql.strip())
+
+
+def make_cache_key(sql: str, fingerprint: str):
+    key = hashlib.sha256(f"{fingerprint}\n{normalize_sql(sql)}".encode("utf-8")).hexdigest()
+    return(key)
+
+
+#%%
+class QueryCache:
+    # Query results stored as Parquet files, keyed by normalized SQL + dataset fingerprint,
+    # with least-recently-used entries evicted once the cache is over max_bytes.
+    # Several processes can share a cache_dir: index.json is re-read and rewritten under a file lock
+    def __init__(self, cache_dir: str = None, max_bytes: int = 256 * 1024 * 1024):
+        if not cache_dir:
+            cache_dir = my_utils.get_specific_path(os.path.join("strava_data", "query_cache"))
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock_path = os.path.join(cache_dir, "index.lock")
+        self.lock = threading.Lock()
+        self.index = self._read_index()
+
+    @contextmanager
+    def _locked(self):
+        # The thread lock covers this process, flock the other processes using the same cache_dir
+        with self.lock, open(self.lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.index = self._read_index()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return({})
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            logging.error(f"Unreadable query cache index, starting empty: {self.index_path}")
+            return({})
+        # Drop entries whose files have gone missing
+        index = {k: v for k, v in index.items() if os.path.exists(os.path.join(self.cache_dir, v["file"]))}
+        return(index)
+
+    def _write_index(self):
+        my_utils.write_json_atomically(self.index, self.index_path)
+
+    def _remove(self, key: str):
+        entry = self.index.pop(key)
+        try:
+            os.remove(os.path.join(self.cache_dir, entry["file"]))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep: str):
+        # Readers of the previous snapshot and the new one share the cache while a sync publishes,
+        # so entries from another load age out by last use like the rest instead of all at once
+        # Result files no index entry points to (files are only published under the lock, so none is in flight)
+        indexed_files = {v["file"] for v in self.index.values()}
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(".parquet") and file_name not in indexed_files:
+                logging.info(f"Removing orphaned query cache file {file_name}")
+                os.remove(os.path.join(self.cache_dir, file_name))
+
+        total_bytes = sum(v["bytes"] for v in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]["last_used"]):
+            if total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total_bytes -= self.index[key]["bytes"]
+            logging.info(f"Evicting query cache entry {key}")
+            self._remove(key)
+
+    def _read_entry(self, cursor, entry: dict):
+        cursor.execute("SELECT * FROM read_parquet(?)", [os.path.join(self.cache_dir, entry["file"])])
+        # Parquet renames duplicate column names (a, a_1), the query's own names are kept in the index
+        columns = entry.get("columns") or [col[0] for col in cursor.description]
+        rows = cursor.fetchall()
+        return({"columns": columns, "rows": rows})
+
+    def get(self, cursor, sql: str, fingerprint: str):
+        key = make_cache_key(sql, fingerprint)
+        with self._locked():
+            entry = self.index.get(key)
+            if entry is None:
+                return(None)
+            entry["last_used"] = time.time()
+            self._write_index()
+
+        # Read outside the lock so report queries don't queue on each other;
+        # another process may evict the file in between, which is just a miss
+        try:
+            return(self._read_entry(cursor, entry))
+        except duckdb.IOException:
+            logging.info(f"Query cache entry {key} was evicted while being read")
+            return(None)
+
+    def put(self, cursor, sql: str, fingerprint: str):
+        # Runs the query straight into a Parquet file, then reads it back
+        key = make_cache_key(sql, fingerprint)
+        file_name = key + ".parquet"
+        file_path = os.path.join(self.cache_dir, file_name)
+        # Unique per process and thread, so two runs caching the same query never share a temp file
+        tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        columns = [row[0] for row in cursor.execute(f"DESCRIBE {sql}").fetchall()]
+        try:
+            cursor.execute(f"COPY ({sql}) TO '{tmp_path}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._locked():
+            os.replace(tmp_path, file_path)
+            self.index[key] = {
+                "file": file_name,
+                "bytes": os.path.getsize(file_path),
+                "fingerprint": fingerprint,
+                "last_used": time.time(),
+                "columns": columns,
+            }
+            self._evict(keep=key)
+            self._write_index()
+            # Read back before the lock is released, nothing can evict it in between
+            result = self._read_entry(cursor, self.index[key])
+
+        return(result)
+
+    def clear(self):
+        with self._locked():
+            for key in list(self.index):
+                self._remove(key)
+            self._write_index()
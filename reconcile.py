@@ -0,0 +1,286 @@
+#%%
+import json
+import hashlib
+import logging
+from datetime import datetime, timezone
+import numpy as np
+import my_utils
+
+#%%
+# Days before the latest local activity that are listed in full on every sync:
+# new uploads, plus the edits and deletions that mostly happen soon after an upload
+recent_window_days = 30
+# Buckets holding at most this many local activities are listed outright instead of split further
+leaf_size = 200
+page_size = 200
+# Positions in a bucket (shares of its local count) whose remote id is checked, besides the last one
+sample_shares = [0.25, 0.5, 0.75]
+# What an edit is judged by; kudos and other counters are refreshed without counting as one
+compared_fields = ["name", "type", "sport_type", "workout_type", "start_date", "distance", "moving_time", "elapsed_time"
+                   , "total_elevation_gain", "average_heartrate", "gear_id", "commute", "trainer", "private"]
+
+create_reconcile_tables_sql = '''
+    CREATE TABLE IF NOT EXISTS activity_changes (
+        id BIGINT
+        ,change VARCHAR
+        ,start_date_local TIMESTAMP
+        ,detected_at TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS reconcile_audit (
+        audited_through BIGINT
+    );
+'''
+
+# Rows other modules built one activity at a time; without them the next update redoes the activity
+derived_activity_tables = ["activity_stress", "route_shapes", "route_bands", "activity_routes", "activity_regions"
+                           , "region_tagged_activities", "activity_details", "activity_splits", "activity_laps"
+                           , "activity_best_efforts", "enrichment_queue", "pace_index_entries"]
+# Daily series that resume from their last day, cut back to the earliest day a change touched
+derived_daily_tables = ["daily_training_load", "fitness_daily"]
+
+
+#%%
+class RemoteActivities:
+    # Date-range views of the athlete's activities. after/before are exclusive epoch seconds,
+    # so a bucket [lo, hi) asks for after=lo-1, before=hi; hi=None is open ended.
+    def __init__(self, headers: dict, activities_url: str):
+        self.headers = headers
+        self.activities_url = activities_url
+        self.request_count = 0
+
+    def get_page(self, lo: int, hi: int, page: int, per_page: int):
+        params = {"after": lo - 1, "page": page, "per_page": per_page}
+        if hi is not None:
+            params["before"] = hi
+        self.request_count += 1
+        response = my_utils.request_with_retry("GET", self.activities_url, headers=self.headers, params=params)
+        if response.status_code != 200:
+            logging.error(f"Activities API request failed: {response.text}")
+            raise Exception("Failed to fetch activities.")
+        return(response.json())
+
+    def bucket_matches(self, lo: int, hi: int, local_ids: list):
+        # Strava has no counts or hashes per date range, one-item pages stand in for them:
+        # item n+1 must not exist, and the items at a few positions up to n must be the ids we have there.
+        # With after set activities come back oldest first, the local order. A deletion next to a
+        # backdated upload keeps the count but shifts every id between them, which a sample in between sees.
+        n = len(local_ids)
+        if self.get_page(lo, hi, n + 1, 1):
+            return(False)
+        positions = sorted({max(1, int(n * share)) for share in sample_shares} | {n}) if n else []
+        for position in reversed(positions):
+            item = self.get_page(lo, hi, position, 1)
+            if len(item) != 1 or item[0]["id"] != local_ids[position - 1]:
+                return(False)
+        return(True)
+
+    def list_bucket(self, lo: int, hi: int):
+        activities = []
+        page = 1
+        while True:
+            batch = self.get_page(lo, hi, page, page_size)
+            activities.extend(batch)
+            if len(batch) < page_size:
+                return(activities)
+            page += 1
+
+
+#%%
+def to_epoch(value):
+    # Local rows hold datetimes, API rows ISO text; both UTC
+    if isinstance(value, str):
+        value = datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return(int(value.timestamp()))
+
+
+def get_content_hash(activity: dict):
+    values = []
+    for field in compared_fields:
+        value = activity.get(field)
+        if field == "start_date" and value is not None:
+            value = to_epoch(value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            # Parquet keeps some integers as doubles
+            value = round(float(value), 1)
+        values.append(value)
+    map_value = activity.get("map")
+    values.append(map_value.get("summary_polyline") if isinstance(map_value, dict) else None)
+    return(hashlib.sha256(json.dumps(values, default=str).encode("utf-8")).hexdigest())
+
+
+def find_changed_buckets(remote: RemoteActivities, ids: np.ndarray, epochs: np.ndarray, lo: int, hi: int):
+    # Halves [lo, hi) on the local start times and only follows halves that don't match remotely.
+    # When the parent disagrees and its first half agrees, the second half is known to disagree.
+    leaves = []
+    stack = [(lo, hi, False)]
+    while stack:
+        lo, hi, known_different = stack.pop()
+        start, end = np.searchsorted(epochs, [lo, hi])
+        if not known_different and remote.bucket_matches(lo, hi, ids[start:end].tolist()):
+            continue
+        split = int(epochs[(start + end) // 2]) if end - start > leaf_size else lo
+        if split <= lo:
+            leaves.append((lo, hi))
+            continue
+        middle = np.searchsorted(epochs, split)
+        if remote.bucket_matches(lo, split, ids[start:middle].tolist()):
+            stack.append((split, hi, True))
+        else:
+            stack.extend([(lo, split, True), (split, hi, False)])
+    return(leaves)
+
+
+#%%
+def forget_activities(con, activity_ids: list, since_date, deleted_ids: list):
+    # Takes back what incremental updates derived from activities that changed or no longer exist
+    existing = {row[0] for row in con.execute("SELECT table_name FROM duckdb_tables() WHERE schema_name = 'main'").fetchall()}
+
+    if "gear_counted_activities" in existing:
+        # Counters are running sums, subtract the old contribution before it is counted again
+        con.execute('''
+            UPDATE gear_counters
+            SET distance_meters = gear_counters.distance_meters - d.distance_meters
+                ,moving_time_secs = gear_counters.moving_time_secs - d.moving_time_secs
+                ,activity_count = gear_counters.activity_count - d.activity_count
+                ,updated_at = now()
+            FROM (
+                SELECT gear_id, sum(distance_meters) AS distance_meters, sum(moving_time_secs) AS moving_time_secs, count(*) AS activity_count
+                FROM gear_counted_activities
+                WHERE id IN (SELECT unnest(?))
+                GROUP BY gear_id
+            ) d
+            WHERE gear_counters.gear_id = d.gear_id
+        ''', [activity_ids])
+        con.execute("DELETE FROM gear_counted_activities WHERE id IN (SELECT unnest(?))", [activity_ids])
+
+    for table_name in derived_activity_tables:
+        if table_name in existing:
+            con.execute(f"DELETE FROM {table_name} WHERE id IN (SELECT unnest(?))", [activity_ids])
+    # Point streams only come from an export archive, an edit doesn't make them stale
+    if "activity_streams" in existing:
+        con.execute("DELETE FROM activity_streams WHERE id IN (SELECT unnest(?))", [deleted_ids])
+    for table_name in derived_daily_tables:
+        if table_name in existing:
+            con.execute(f"DELETE FROM {table_name} WHERE activity_date >= ?", [since_date])
+
+
+def get_audit_bucket(con, epochs: np.ndarray, window_start: int):
+    # One old bucket is listed in full on every sync whatever the probes say, oldest first and then round
+    # again, so what the samples can't see (changes side by side, old edits) is picked up within a cycle
+    window_index = np.searchsorted(epochs, window_start)
+    if window_index == 0:
+        return(None)
+    lo = con.execute("SELECT max(audited_through) FROM reconcile_audit").fetchone()[0] or 0
+    start = np.searchsorted(epochs, lo)
+    if start >= window_index:
+        lo, start = 0, 0
+    end = start + leaf_size
+    hi = int(epochs[end]) if end < window_index else window_start
+    con.execute("DELETE FROM reconcile_audit")
+    con.execute("INSERT INTO reconcile_audit VALUES (?)", [hi if hi < window_start else 0])
+    return((lo, hi))
+
+
+def to_local_datetime(value):
+    # API rows hold ISO text, loaded rows datetimes
+    if isinstance(value, str):
+        value = datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+    return(value)
+
+
+def record_changes(con, local_rows: dict, remote_activities: dict, listed_ids: set):
+    # Compares what was listed remotely with the local rows, takes back what the derived tables
+    # built from the deleted and edited activities and logs every change in activity_changes
+    deleted_ids = sorted(listed_ids - set(remote_activities))
+    added_ids = sorted(set(remote_activities) - set(local_rows))
+    edited_ids = sorted(activity_id for activity_id, activity in remote_activities.items()
+                        if activity_id in local_rows and get_content_hash(activity) != get_content_hash(local_rows[activity_id]))
+
+    changes = [(activity_id, "deleted", local_rows[activity_id]["start_date_local"]) for activity_id in deleted_ids]
+    changes += [(activity_id, "edited", local_rows[activity_id]["start_date_local"]) for activity_id in edited_ids]
+    changes += [(activity_id, "added", to_local_datetime(remote_activities[activity_id]["start_date_local"])) for activity_id in added_ids]
+    if changes:
+        # An edit may also have moved the activity to another day, and an added one may be backdated
+        affected_dates = [change[2] for change in changes]
+        affected_dates += [to_local_datetime(remote_activities[activity_id]["start_date_local"]) for activity_id in edited_ids]
+        forget_activities(con, deleted_ids + edited_ids, min(affected_dates).date(), deleted_ids)
+        con.executemany("INSERT INTO activity_changes VALUES (?, ?, ?, now())", changes)
+
+    return({"added": added_ids, "edited": edited_ids, "deleted": deleted_ids})
+
+
+def forget_replaced_history(con, table):
+    # A full reload or an archive import replaces raw_activities wholesale, so the whole
+    # previous history counts as listed and is diffed against the new load like a reconciled bucket
+    logging.info("Starting the forget_replaced_history() function")
+    con.execute(create_reconcile_tables_sql)
+
+    local_rows = {row["id"]: row for row in con.sql("SELECT * FROM raw_activities").to_arrow_table().to_pylist()}
+    new_rows = {row["id"]: row for row in table.to_pylist()}
+    changes = record_changes(con, local_rows, new_rows, set(local_rows))
+
+    logging.info(f"{len(changes['added'])} added, {len(changes['edited'])} edited, {len(changes['deleted'])} deleted")
+    logging.info("forget_replaced_history() function completed")
+
+    return(changes)
+
+
+def has_local_history(con):
+    table_count = con.execute("SELECT count(*) FROM duckdb_tables() WHERE schema_name = 'main' AND table_name = 'raw_activities'").fetchone()[0]
+    return(table_count > 0 and con.execute("SELECT count(*) FROM raw_activities").fetchone()[0] > 0)
+
+
+#%%
+def reconcile_activities(con, export_path: str, activities_url: str = "https://www.strava.com/api/v3/athlete/activities"):
+    logging.info("Starting the reconcile_activities() function")
+    con.execute(create_reconcile_tables_sql)
+
+    local = con.execute('''
+        SELECT id, epoch(start_date)::BIGINT AS start_epoch
+        FROM raw_activities
+        ORDER BY start_epoch, id
+    ''').fetchnumpy()
+    ids, epochs = np.asarray(local["id"]), np.asarray(local["start_epoch"])
+
+    access_token = my_utils.refresh_access_token()
+    remote = RemoteActivities({"Authorization": f"Bearer {access_token}"}, activities_url)
+
+    # The recent window is always listed, which is also the incremental sync;
+    # older history is only listed where the buckets don't match, plus one rotating audit bucket
+    window_start = int(epochs[-1]) - recent_window_days * 86400
+    leaves = [(window_start, None)] + find_changed_buckets(remote, ids, epochs, 0, window_start)
+    probe_count = remote.request_count
+    audit_bucket = get_audit_bucket(con, epochs, window_start)
+    if audit_bucket is not None and audit_bucket not in leaves:
+        leaves.append(audit_bucket)
+
+    listed_ids, remote_activities = set(), {}
+    for lo, hi in leaves:
+        start, end = np.searchsorted(epochs, [lo, hi if hi is not None else np.iinfo(np.int64).max])
+        listed_ids.update(ids[start:end].tolist())
+        for activity in remote.list_bucket(lo, hi):
+            remote_activities[activity["id"]] = activity
+
+    local_rows = {row["id"]: row for row in con.sql("SELECT * FROM raw_activities WHERE id IN (SELECT unnest($ids))"
+                                                    , params={"ids": sorted(listed_ids | set(remote_activities))}).to_arrow_table().to_pylist()}
+    changes = record_changes(con, local_rows, remote_activities, listed_ids)
+    added_ids, edited_ids, deleted_ids = changes["added"], changes["edited"], changes["deleted"]
+
+    # Everything not listed is kept as it was, listed buckets are replaced by what Strava returned
+    # (UNION BY NAME also lines up struct fields and columns that only one side has)
+    con.register("fetched_activities", my_utils.pages_to_arrow([list(remote_activities.values())], datetime.now()))
+    table = con.sql('''
+        SELECT * FROM raw_activities WHERE id NOT IN (SELECT unnest($ids))
+        UNION ALL BY NAME
+        SELECT * FROM fetched_activities
+    ''', params={"ids": sorted(listed_ids | set(remote_activities))}).to_arrow_table()
+    con.unregister("fetched_activities")
+    my_utils.write_parquet_atomically(table, export_path)
+
+    logging.info(f"Reconciled {len(ids)} local activities in {remote.request_count} requests ({probe_count} bucket probes, {len(leaves)} buckets listed)")
+    logging.info(f"{len(added_ids)} added, {len(edited_ids)} edited, {len(deleted_ids)} deleted")
+    logging.info("reconcile_activities() function completed")
+
+    return(table, changes)
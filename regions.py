@@ -0,0 +1,228 @@
+#%%
+import os
+import ast
+import glob
+import json
+import math
+import hashlib
+import logging
+import numpy as np
+import pyarrow as pa
+import my_utils
+import routes
+
+#%%
+# Local boundary files, one region type per file named after it (countries.geojson, cities.geojson, parks.geojson)
+default_regions_dir = os.path.join("strava_data", "regions")
+# Entries per R-tree node
+node_capacity = 16
+# Track points kept per activity for pass-through tags, and activities tagged per batch
+max_track_points = 200
+batch_size = 500
+# Largest points x edges block for one point-in-polygon test
+max_block_size = 2_000_000
+
+create_region_tables_sql = '''
+    CREATE TABLE IF NOT EXISTS regions (
+        region_id VARCHAR PRIMARY KEY
+        ,region_type VARCHAR
+        ,name VARCHAR
+    );
+    CREATE TABLE IF NOT EXISTS activity_regions (
+        id BIGINT
+        ,region_id VARCHAR
+        ,relation VARCHAR
+        ,PRIMARY KEY (id, region_id, relation)
+    );
+    CREATE TABLE IF NOT EXISTS region_tagged_activities (
+        id BIGINT PRIMARY KEY
+        ,boundaries_fingerprint VARCHAR
+    );
+'''
+
+activity_region_schema = pa.schema([("id", pa.int64()), ("region_id", pa.string()), ("relation", pa.string())])
+
+
+#%%
+def load_regions(region_files: list):
+    # One entry per feature: every ring of every polygon (holes included) as (lng, lat) arrays
+    regions = []
+    for path in region_files:
+        region_type = os.path.splitext(os.path.basename(path))[0]
+        with open(path) as f:
+            collection = json.load(f)
+        for i, feature in enumerate(collection.get("features", [])):
+            geometry = feature.get("geometry") or {}
+            if geometry.get("type") == "Polygon":
+                polygons = [geometry["coordinates"]]
+            elif geometry.get("type") == "MultiPolygon":
+                polygons = geometry["coordinates"]
+            else:
+                continue
+            rings = [np.asarray(ring, dtype=float)[:, :2] for polygon in polygons for ring in polygon if len(ring) >= 3]
+            if not rings:
+                continue
+            corners = np.concatenate(rings)
+            properties = feature.get("properties") or {}
+            regions.append({"region_id": f"{region_type}:{i}", "region_type": region_type
+                            , "name": properties.get("name") or properties.get("NAME") or f"{region_type} {i}"
+                            , "rings": rings, "box": np.concatenate([corners.min(axis=0), corners.max(axis=0)])})
+    return(regions)
+
+
+def pack_level(entries: list, leaf: bool):
+    # Sort-Tile-Recursive: strips by x center, each strip by y center, groups of node_capacity
+    n = len(entries)
+    strips = math.ceil(math.sqrt(math.ceil(n / node_capacity)))
+    per_strip = math.ceil(n / strips)
+    entries = sorted(entries, key=lambda e: e["box"][0] + e["box"][2])
+    nodes = []
+    for s in range(0, n, per_strip):
+        strip = sorted(entries[s:s + per_strip], key=lambda e: e["box"][1] + e["box"][3])
+        for g in range(0, len(strip), node_capacity):
+            children = strip[g:g + node_capacity]
+            boxes = np.array([child["box"] for child in children])
+            nodes.append({"box": np.concatenate([boxes[:, :2].min(axis=0), boxes[:, 2:].max(axis=0)])
+                          , "children": children, "leaf": leaf})
+    return(nodes)
+
+
+class RTree:
+    # Packed once from the region bounding boxes, queried with whole batches of points:
+    # each node narrows the array of points still inside it
+    def __init__(self, boxes: list):
+        nodes = pack_level([{"box": box, "item": i} for i, box in enumerate(boxes)], leaf=True) if boxes else []
+        while len(nodes) > 1:
+            nodes = pack_level(nodes, leaf=False)
+        self.root = nodes[0] if nodes else None
+
+    def query(self, points: np.ndarray):
+        # (point indexes, item) for every item whose box holds those points
+        matches = []
+        if self.root is None:
+            return(matches)
+        stack = [(self.root, np.arange(len(points)))]
+        while stack:
+            node, index = stack.pop()
+            x, y = points[index, 0], points[index, 1]
+            for child in node["children"]:
+                box = child["box"]
+                inside = index[(x >= box[0]) & (x <= box[2]) & (y >= box[1]) & (y <= box[3])]
+                if inside.size == 0:
+                    continue
+                if node["leaf"]:
+                    matches.append((inside, child["item"]))
+                else:
+                    stack.append((child, inside))
+        return(matches)
+
+
+def points_in_rings(points: np.ndarray, rings: list):
+    # Even-odd ray casting against every edge at once; holes and separate parts fall out of the parity
+    inside = np.zeros(len(points), dtype=bool)
+    for ring in rings:
+        x1, y1 = ring[:, 0], ring[:, 1]
+        x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+        rows = max(1, max_block_size // len(ring))
+        for start in range(0, len(points), rows):
+            px, py = points[start:start + rows, 0:1], points[start:start + rows, 1:2]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                crossings = ((y1 > py) != (y2 > py)) & (px < (x2 - x1) * (py - y1) / (y2 - y1) + x1)
+            inside[start:start + rows] ^= crossings.sum(axis=1) % 2 == 1
+    return(inside)
+
+
+def get_start_point(start_latlng):
+    # A list from Parquet, its string form from an old CSV export; returned as (lng, lat)
+    if isinstance(start_latlng, str):
+        try:
+            start_latlng = ast.literal_eval(start_latlng)
+        except (ValueError, SyntaxError):
+            return(None)
+    if not start_latlng or len(start_latlng) < 2 or start_latlng[0] is None:
+        return(None)
+    return((start_latlng[1], start_latlng[0]))
+
+
+#%%
+def tag_batch(activities: list, regions: list, tree: RTree):
+    # All points of the batch in one array: start points, then downsampled tracks
+    points, owners, is_start = [], [], []
+    for activity_id, start_latlng, map_value in activities:
+        start = get_start_point(start_latlng)
+        if start is not None:
+            points.append(np.array([start]))
+            owners.append([activity_id])
+            is_start.append([True])
+        track = routes.get_route_points(map_value)
+        if track is not None:
+            track = track[np.linspace(0, len(track) - 1, min(len(track), max_track_points)).astype(int)][:, ::-1]
+            points.append(track)
+            owners.append([activity_id] * len(track))
+            is_start.append([False] * len(track))
+    if not points:
+        return([])
+    points, owners, is_start = np.concatenate(points), np.concatenate(owners), np.concatenate(is_start)
+
+    rows = []
+    for index, item in tree.query(points):
+        hits = index[points_in_rings(points[index], regions[item]["rings"])]
+        if hits.size == 0:
+            continue
+        region_id = regions[item]["region_id"]
+        for activity_id in np.unique(owners[hits]):
+            rows.append({"id": int(activity_id), "region_id": region_id, "relation": "pass"})
+        for activity_id in np.unique(owners[hits[is_start[hits]]]):
+            rows.append({"id": int(activity_id), "region_id": region_id, "relation": "start"})
+    return(rows)
+
+
+def update_activity_regions(con, regions_dir: str = None):
+    logging.info("Starting the update_activity_regions() function")
+    con.execute(create_region_tables_sql)
+
+    if not regions_dir:
+        regions_dir = my_utils.get_specific_path(default_regions_dir)
+    region_files = sorted(glob.glob(os.path.join(regions_dir, "*.geojson")))
+    if not region_files:
+        logging.info(f"No boundary files in {regions_dir}, skipping region tagging")
+        return(0)
+
+    # Tags are only as good as the boundaries they came from, new boundaries mean tagging everything again
+    fingerprint = hashlib.sha256("|".join(my_utils.get_file_fingerprint(path) for path in region_files).encode("utf-8")).hexdigest()
+    stale = con.execute("SELECT count(*) FROM region_tagged_activities WHERE boundaries_fingerprint <> ?", [fingerprint]).fetchone()[0]
+    if stale:
+        logging.info("Boundary files changed, re-tagging every activity")
+        con.execute("DELETE FROM activity_regions")
+        con.execute("DELETE FROM region_tagged_activities")
+
+    regions = load_regions(region_files)
+    tree = RTree([region["box"] for region in regions])
+    con.execute("DELETE FROM regions")
+    con.register("loaded_regions", pa.Table.from_pylist([{k: region[k] for k in ("region_id", "region_type", "name")} for region in regions]
+                                                        , schema=pa.schema([("region_id", pa.string()), ("region_type", pa.string()), ("name", pa.string())])))
+    con.execute("INSERT INTO regions SELECT * FROM loaded_regions")
+    con.unregister("loaded_regions")
+
+    new_activities = con.execute('''
+        SELECT id, start_latlng, map
+        FROM staging
+        WHERE id NOT IN (SELECT id FROM region_tagged_activities)
+        ORDER BY id
+    ''').fetchall()
+
+    tag_count = 0
+    for start in range(0, len(new_activities), batch_size):
+        batch = new_activities[start:start + batch_size]
+        rows = tag_batch(batch, regions, tree)
+        if rows:
+            con.register("new_activity_regions", pa.Table.from_pylist(rows, schema=activity_region_schema))
+            con.execute("INSERT INTO activity_regions SELECT * FROM new_activity_regions")
+            con.unregister("new_activity_regions")
+        con.execute("INSERT INTO region_tagged_activities SELECT unnest(?), ?", [[row[0] for row in batch], fingerprint])
+        tag_count += len(rows)
+
+    logging.info(f"Tagged {len(new_activities)} activities against {len(regions)} regions, {tag_count} tags")
+    logging.info("update_activity_regions() function completed")
+
+    return(len(new_activities))
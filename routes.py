@@ -0,0 +1,293 @@
+#%%
+import ast
+import logging
+import numpy as np
+import pyarrow as pa
+
+#%%
+# Grid cells (degrees, about 110 m) a route passes through make up its signature
+cell_degrees = 0.001
+# MinHash signature length, cut into bands of band_rows for locality-sensitive hashing.
+# Two routes sharing any band become candidates, likely once their cells overlap about half.
+num_hashes = 64
+band_rows = 4
+# Neighbours per side an activity is paired with inside a band bucket, and the strongest
+# candidates (most shared bands) kept per activity; the union-find takes care of the rest of a route
+bucket_neighbours = 5
+max_candidates = 20
+# Points each route is resampled to for the shape check, and the mean gap (meters) still the same route
+shape_points = 32
+match_meters = 75
+# Routes with at least this many runs get a pace trend
+min_route_runs = 3
+
+meters_per_degree = 111320
+# Fixed seed, signatures and band keys have to stay comparable across syncs
+hash_seeds = np.random.default_rng(2025).integers(0, np.iinfo(np.uint64).max, size=num_hashes, dtype=np.uint64)
+
+create_route_tables_sql = '''
+    CREATE TABLE IF NOT EXISTS route_shapes (
+        id BIGINT PRIMARY KEY
+        ,shape DOUBLE[]
+    );
+    CREATE TABLE IF NOT EXISTS route_bands (
+        band_key BIGINT
+        ,id BIGINT
+    );
+    CREATE TABLE IF NOT EXISTS activity_routes (
+        id BIGINT PRIMARY KEY
+        ,route_id BIGINT
+    );
+'''
+
+shape_schema = pa.schema([("id", pa.int64()), ("shape", pa.list_(pa.float64()))])
+band_schema = pa.schema([("band_key", pa.int64()), ("id", pa.int64())])
+
+# Per route: how the pace moved over time, slope from a least squares fit over the run dates
+route_pace_trends_sql = f'''
+    WITH route_runs AS (
+        SELECT r.route_id, s.name, s.start_date_local, s.distance_miles, s.average_pace_mins_per_mile
+        FROM activity_routes r
+        JOIN staging s USING (id)
+        WHERE s.type = 'Run'
+            AND s.distance_miles > 0
+    )
+    SELECT
+        route_id
+        ,arg_max(name, start_date_local) AS latest_name
+        ,count(*) AS runs
+        ,round(avg(distance_miles),2) AS avg_distance_miles
+        ,min(start_date_local)::DATE AS first_run
+        ,max(start_date_local)::DATE AS last_run
+        ,round(min(average_pace_mins_per_mile),2) AS best_pace
+        ,round(avg(average_pace_mins_per_mile),2) AS avg_pace
+        ,round(arg_max(average_pace_mins_per_mile, start_date_local),2) AS latest_pace
+        -- minutes per mile per 30 days, negative is getting faster
+        ,round(regr_slope(average_pace_mins_per_mile, epoch(start_date_local) / 86400) * 30, 3) AS pace_change_per_30_days
+    FROM route_runs
+    GROUP BY route_id
+    HAVING count(*) >= {min_route_runs}
+    ORDER BY runs DESC
+'''
+
+
+#%%
+def decode_polyline(polyline: str):
+    # Google encoded polyline, 1e-5 degree precision
+    coords = []
+    index, lat, lng = 0, 0, 0
+    while index < len(polyline):
+        deltas = []
+        for _ in range(2):
+            shift, result = 0, 0
+            while True:
+                b = ord(polyline[index]) - 63
+                index += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coords.append((lat / 1e5, lng / 1e5))
+    return(np.array(coords, dtype=float).reshape(-1, 2))
+
+
+def get_route_points(map_value):
+    # map is a struct when loaded from Parquet, its string form when loaded from an old CSV export
+    if isinstance(map_value, str):
+        try:
+            map_value = ast.literal_eval(map_value)
+        except (ValueError, SyntaxError):
+            return(None)
+    polyline = (map_value or {}).get("summary_polyline")
+    if not polyline:
+        return(None)
+    try:
+        points = decode_polyline(polyline)
+    except IndexError:
+        logging.warning("Skipping a truncated polyline")
+        return(None)
+    return(points if len(points) >= 2 else None)
+
+
+def get_path_positions(points: np.ndarray):
+    # Distance along the path (meters) at each point
+    lat_scale = np.cos(np.radians(points[:, 0].mean()))
+    steps = np.hypot(np.diff(points[:, 0]), np.diff(points[:, 1]) * lat_scale) * meters_per_degree
+    return(np.concatenate([[0.0], np.cumsum(steps)]))
+
+
+def resample(points: np.ndarray, n: int):
+    # n points evenly spaced along the path
+    along = get_path_positions(points)
+    if along[-1] == 0:
+        return(np.repeat(points[:1], n, axis=0))
+    targets = np.linspace(0, along[-1], n)
+    return(np.column_stack([np.interp(targets, along, points[:, 0]), np.interp(targets, along, points[:, 1])]))
+
+
+def mix64(x: np.ndarray):
+    # splitmix64 finalizer, wrapping uint64 arithmetic. Neighbouring cells have neighbouring
+    # ids, a weaker hash would keep them in order and every minimum would sit at a path end.
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return(x ^ (x >> np.uint64(31)))
+
+
+def get_band_keys(points: np.ndarray):
+    # Cells the route passes through, sampled every half cell so none are skipped
+    cell_meters = cell_degrees * meters_per_degree
+    n = int(np.clip(get_path_positions(points)[-1] / (cell_meters / 2), 2, 4000))
+    cells = np.unique(np.floor(resample(points, n) / cell_degrees).astype(np.int64), axis=0).astype(np.uint64)
+    cell_ids = (cells[:, 0] << np.uint64(32)) | (cells[:, 1] & np.uint64(0xFFFFFFFF))
+
+    # MinHash: per hash function, the smallest hash over the cells
+    signature = mix64(cell_ids[None, :] ^ hash_seeds[:, None]).min(axis=1)
+
+    # One key per band, the band number mixed in so equal rows in different bands don't collide
+    bands = signature.reshape(-1, band_rows)
+    keys = np.arange(len(bands), dtype=np.uint64)
+    for row in range(band_rows):
+        keys = mix64(keys ^ bands[:, row])
+    return(keys.view(np.int64).tolist())
+
+
+def get_shape_distances(a: np.ndarray, b: np.ndarray):
+    # a, b: (pairs, shape_points, 2). Mean gap in meters between matching points,
+    # in whichever direction of travel fits better
+    lat_scale = np.cos(np.radians(a[:, :, 0].mean(axis=1)))[:, None]
+    distances = []
+    for other in (b, b[:, ::-1]):
+        gaps = np.hypot(a[:, :, 0] - other[:, :, 0], (a[:, :, 1] - other[:, :, 1]) * lat_scale) * meters_per_degree
+        distances.append(gaps.mean(axis=1))
+    return(np.minimum(*distances))
+
+
+def find_root(parent: dict, node: int):
+    parent.setdefault(node, node)
+    while parent[node] != node:
+        parent[node] = parent[parent[node]]
+        node = parent[node]
+    return(node)
+
+
+def union(parent: dict, a: int, b: int):
+    # The smallest activity id names the route, so existing route ids survive merges where they can
+    root_a, root_b = find_root(parent, a), find_root(parent, b)
+    if root_a != root_b:
+        parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+#%%
+def update_activity_routes(con):
+    logging.info("Starting the update_activity_routes() function")
+    con.execute(create_route_tables_sql)
+
+    new_activities = con.execute('''
+        SELECT id, map
+        FROM staging
+        WHERE id NOT IN (SELECT id FROM activity_routes)
+        ORDER BY id
+    ''').fetchall()
+    if not new_activities:
+        logging.info("No new activities to route")
+        return(0)
+
+    shapes, bands, no_route = {}, [], []
+    for activity_id, map_value in new_activities:
+        points = get_route_points(map_value)
+        if points is None:
+            no_route.append(activity_id)
+            continue
+        shapes[activity_id] = resample(points, shape_points)
+        bands.extend({"band_key": key, "id": activity_id} for key in get_band_keys(points))
+
+    if shapes:
+        con.register("new_route_shapes", pa.Table.from_pylist(
+            [{"id": activity_id, "shape": shape.ravel().tolist()} for activity_id, shape in shapes.items()], schema=shape_schema))
+        con.execute("INSERT INTO route_shapes SELECT * FROM new_route_shapes")
+        con.unregister("new_route_shapes")
+        con.register("new_route_bands", pa.Table.from_pylist(bands, schema=band_schema))
+        con.execute("CREATE OR REPLACE TEMP TABLE new_bands AS SELECT * FROM new_route_bands")
+        con.unregister("new_route_bands")
+        con.execute("INSERT INTO route_bands SELECT * FROM new_bands")
+    else:
+        con.execute("CREATE OR REPLACE TEMP TABLE new_bands AS SELECT * FROM route_bands LIMIT 0")
+
+    # Candidates share a band. A popular route fills its buckets with thousands of activities,
+    # so each one is only paired with its neighbours (by id) inside the bucket: the chain still
+    # links the whole route through the union-find, and the pairs grow linearly. New pairs are listed once.
+    candidates = con.execute(f'''
+        WITH neighbours AS (
+            SELECT
+                id
+                ,list(id) OVER (
+                    PARTITION BY band_key ORDER BY id
+                    ROWS BETWEEN {bucket_neighbours} PRECEDING AND {bucket_neighbours} FOLLOWING
+                ) AS nearby_ids
+            FROM route_bands
+            WHERE band_key IN (SELECT band_key FROM new_bands)
+        )
+        , pairs AS (
+            SELECT id AS new_id, unnest(nearby_ids) AS other_id
+            FROM neighbours
+            WHERE id IN (SELECT id FROM new_bands)
+        )
+        SELECT new_id, other_id, count(*) AS shared_bands
+        FROM pairs
+        WHERE other_id <> new_id
+            AND (other_id < new_id OR other_id NOT IN (SELECT id FROM new_bands))
+        GROUP BY new_id, other_id
+        QUALIFY row_number() OVER (PARTITION BY new_id ORDER BY shared_bands DESC, other_id DESC) <= {max_candidates}
+    ''').fetchall()
+
+    # Confirm each candidate with the shape check
+    new_ids = list(shapes)
+    other_ids = {other_id for _, other_id, _ in candidates if other_id not in shapes}
+    if other_ids:
+        for activity_id, shape in con.execute("SELECT id, shape FROM route_shapes WHERE id IN (SELECT unnest(?))"
+                                              , [list(other_ids)]).fetchall():
+            shapes[activity_id] = np.array(shape).reshape(-1, 2)
+    matches = []
+    for start in range(0, len(candidates), 50000):
+        chunk = candidates[start:start + 50000]
+        a = np.stack([shapes[new_id] for new_id, _, _ in chunk])
+        b = np.stack([shapes[other_id] for _, other_id, _ in chunk])
+        close = get_shape_distances(a, b) <= match_meters
+        matches.extend((new_id, other_id) for (new_id, other_id, _), is_close in zip(chunk, close) if is_close)
+
+    # Connected components over confirmed matches, joined to the routes the older activities are on
+    parent = {}
+    for new_id, other_id in matches:
+        union(parent, new_id, other_id)
+    old_routes = dict(con.execute("SELECT id, route_id FROM activity_routes WHERE id IN (SELECT unnest(?))"
+                                  , [list(other_ids)]).fetchall()) if other_ids else {}
+    for activity_id, route_id in old_routes.items():
+        union(parent, activity_id, route_id)
+
+    # Older routes that a new activity bridged into one
+    merged = [{"old_route_id": route_id, "route_id": find_root(parent, route_id)}
+              for route_id in set(old_routes.values()) if find_root(parent, route_id) != route_id]
+    if merged:
+        con.register("merged_routes", pa.Table.from_pylist(merged))
+        con.execute('''
+            UPDATE activity_routes SET route_id = m.route_id
+            FROM merged_routes m
+            WHERE activity_routes.route_id = m.old_route_id
+        ''')
+        con.unregister("merged_routes")
+
+    routed = [{"id": activity_id, "route_id": find_root(parent, activity_id)} for activity_id in new_ids]
+    routed += [{"id": activity_id, "route_id": None} for activity_id in no_route]
+    con.register("routed_activities", pa.Table.from_pylist(routed, schema=pa.schema([("id", pa.int64()), ("route_id", pa.int64())])))
+    con.execute("INSERT INTO activity_routes SELECT * FROM routed_activities")
+    con.unregister("routed_activities")
+
+    logging.info(f"Routed {len(routed)} activities ({len(no_route)} without a map), "
+                 f"{len(candidates)} candidates, {len(matches)} matches, {len(merged)} routes merged")
+    logging.info("update_activity_routes() function completed")
+
+    return(len(routed))
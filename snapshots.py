@@ -0,0 +1,101 @@
+#%%
+import os
+import glob
+import json
+import fcntl
+import shutil
+import logging
+from datetime import datetime
+import my_utils
+
+#%%
+# Published databases kept on disk; readers still holding an older one keep reading it
+default_keep_snapshots = 3
+
+
+def get_snapshot_dir():
+    snapshot_dir = my_utils.get_specific_path(os.path.join("strava_data", "snapshots"))
+    os.makedirs(snapshot_dir, exist_ok=True)
+    return(snapshot_dir)
+
+
+def get_current_snapshot_path(snapshot_dir: str = None):
+    # The CURRENT pointer names the latest published database, None before the first publish
+    if not snapshot_dir:
+        snapshot_dir = get_snapshot_dir()
+    pointer_path = os.path.join(snapshot_dir, "CURRENT")
+    if not os.path.exists(pointer_path):
+        return(None)
+
+    with open(pointer_path) as f:
+        pointer = json.load(f)
+    return(os.path.join(snapshot_dir, pointer["snapshot"]))
+
+
+#%%
+def connect_to_current_snapshot(snapshot_dir: str = None):
+    # Readers never see a database that is being written, only published ones
+    snapshot_path = get_current_snapshot_path(snapshot_dir)
+    if snapshot_path is None:
+        logging.error("No published snapshot yet, run data_load first")
+        raise FileNotFoundError("No published snapshot in the snapshot directory")
+
+    con = my_utils.connect_to_duckdb(snapshot_path, read_only=True)
+    return(con)
+
+
+def begin_snapshot(snapshot_dir: str = None):
+    logging.info("Starting the begin_snapshot() function")
+
+    if not snapshot_dir:
+        snapshot_dir = get_snapshot_dir()
+
+    # One writer at a time, a second sync waits here instead of interleaving with the first
+    lock_file = open(os.path.join(snapshot_dir, "writer.lock"), "w")
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+    # Leftovers from a writer that died before publishing
+    for stale_path in glob.glob(os.path.join(snapshot_dir, "*.duckdb.tmp*")):
+        logging.info(f"Removing unpublished snapshot: {stale_path}")
+        os.remove(stale_path)
+
+    # The next snapshot starts as a copy of the current one, so the incremental tables carry over.
+    # The very first one starts from the old shared database if there is one.
+    name = f"strava_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.duckdb"
+    tmp_path = os.path.join(snapshot_dir, name + ".tmp")
+    source_path = get_current_snapshot_path(snapshot_dir)
+    if source_path is None:
+        source_path = my_utils.get_specific_path(os.path.join("strava_data", "strava.duckdb"))
+    if os.path.exists(source_path):
+        shutil.copyfile(source_path, tmp_path)
+        logging.info(f"Copied {source_path} into the next snapshot")
+
+    con = my_utils.connect_to_duckdb(tmp_path)
+    snapshot = {"snapshot_dir": snapshot_dir, "name": name, "tmp_path": tmp_path, "lock_file": lock_file}
+
+    logging.info("begin_snapshot() function completed")
+    return(con, snapshot)
+
+
+def publish_snapshot(con, snapshot: dict, keep: int = default_keep_snapshots):
+    logging.info("Starting the publish_snapshot() function")
+
+    # Everything goes into the main file before it becomes visible
+    con.execute("CHECKPOINT")
+    con.close()
+
+    snapshot_dir = snapshot["snapshot_dir"]
+    os.replace(snapshot["tmp_path"], os.path.join(snapshot_dir, snapshot["name"]))
+    my_utils.write_json_atomically({"snapshot": snapshot["name"], "published_at": datetime.now().isoformat()}
+                                   , os.path.join(snapshot_dir, "CURRENT"))
+    logging.info(f"Published snapshot {snapshot['name']}")
+
+    # Names sort by time; open readers of a removed file keep their handle until they close it
+    published = sorted(glob.glob(os.path.join(snapshot_dir, "strava_*.duckdb")))
+    for old_path in published[:-keep]:
+        logging.info(f"Removing old snapshot: {old_path}")
+        os.remove(old_path)
+
+    fcntl.flock(snapshot["lock_file"], fcntl.LOCK_UN)
+    snapshot["lock_file"].close()
+    logging.info("publish_snapshot() function completed")
@@ -0,0 +1,143 @@
+#%%
+import os
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from jinja2 import Template
+import my_utils
+import analysis_queries
+import query_cache
+import snapshots
+
+#%%
+# Activity names and other values are user text, autoescape keeps them from being read as markup
+report_html_template = Template('''<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>Strava report {{ generated_at }}</title>
+    <style>
+        body { font-family: sans-serif; margin: 2em; }
+        table { border-collapse: collapse; margin-bottom: 2em; }
+        th, td { border: 1px solid #ccc; padding: 4px 8px; text-align: right; }
+        th { background: #f3f3f3; }
+        .timing { color: #888; font-size: 0.8em; }
+    </style>
+</head>
+<body>
+    <h1>Strava report</h1>
+    <p class="timing">Generated {{ generated_at }} in {{ "%.3f"|format(total_secs) }}s</p>
+    {% for result in results %}
+    <h2>{{ result.name }}</h2>
+    <p class="timing">{{ "%.3f"|format(result.secs) }}s{% if result.cached %} (cached){% endif %}</p>
+    <table>
+        <tr>{% for col in result.columns %}<th>{{ col }}</th>{% endfor %}</tr>
+        {% for row in result.rows %}
+        <tr>{% for value in row %}<td>{{ value }}</td>{% endfor %}</tr>
+        {% endfor %}
+    </table>
+    {% endfor %}
+</body>
+</html>
+''', autoescape=True)
+
+
+#%%
+def run_named_query(con, name: str, sql: str, cache=None, fingerprint: str = None):
+    # Each thread gets its own cursor (its own connection to the same database)
+    cursor = con.cursor()
+    start = time.perf_counter()
+    cached = False
+    try:
+        if cache is not None:
+            result = cache.get(cursor, sql, fingerprint)
+            cached = result is not None
+            if not cached:
+                result = cache.put(cursor, sql, fingerprint)
+            columns, rows = result["columns"], result["rows"]
+        else:
+            cursor.execute(sql)
+            columns = [col[0] for col in cursor.description]
+            rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    secs = time.perf_counter() - start
+    logging.info(f"Query {name} returned {len(rows)} rows in {secs:.3f}s (cached: {cached})")
+
+    return({"name": name, "columns": columns, "rows": rows, "secs": secs, "cached": cached})
+
+
+def run_report_queries(con, queries: dict = None, max_workers: int = None, cache=None):
+    logging.info("Starting the run_report_queries() function")
+
+    if queries is None:
+        queries = analysis_queries.report_queries
+    if max_workers is None:
+        max_workers = min(len(queries), os.cpu_count() or 1)
+    # Looked up once so every query in the run is keyed on the same load
+    fingerprint = my_utils.get_dataset_fingerprint(con) if cache is not None else None
+
+    # Wall time is bounded by the slowest query rather than the sum of all of them
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {name: pool.submit(run_named_query, con, name, sql, cache, fingerprint) for name, sql in queries.items()}
+        # Keep the results in registration order
+        results = [futures[name].result() for name in queries]
+
+    logging.info("run_report_queries() function completed")
+
+    return(results)
+
+
+def render_report(results: list, html_path: str = None, json_path: str = None, total_secs: float = 0.0):
+    generated_at = my_utils.get_today_as_timestamp().strftime("%Y-%m-%d %H:%M:%S")
+
+    if html_path:
+        with open(html_path, "w") as f:
+            f.write(report_html_template.render(results=results, generated_at=generated_at, total_secs=total_secs))
+        logging.info(f"Report HTML deposited into: {html_path}")
+
+    if json_path:
+        payload = {
+            "generated_at": generated_at,
+            "total_secs": total_secs,
+            "results": [
+                {"name": r["name"], "secs": r["secs"], "cached": r["cached"], "columns": r["columns"]
+                 , "rows": [dict(zip(r["columns"], row)) for row in r["rows"]]}
+                for r in results
+            ],
+        }
+        with open(json_path, "w") as f:
+            # Dates and decimals come back from DuckDB as Python objects
+            json.dump(payload, f, indent=2, default=str)
+        logging.info(f"Report JSON deposited into: {json_path}")
+
+
+def generate_report(con, report_dir: str = "reports", queries: dict = None, max_workers: int = None, cache=None):
+    logging.info("Starting the generate_report() function")
+
+    report_dir = my_utils.get_specific_path(report_dir)
+    os.makedirs(report_dir, exist_ok=True)
+    filename = f"strava_report_{my_utils.get_today_as_date()}"
+
+    start = time.perf_counter()
+    results = run_report_queries(con, queries, max_workers, cache)
+    total_secs = time.perf_counter() - start
+
+    html_path = os.path.join(report_dir, filename + ".html")
+    json_path = os.path.join(report_dir, filename + ".json")
+    render_report(results, html_path, json_path, total_secs)
+
+    logging.info(f"generate_report() function completed in {total_secs:.3f}s")
+
+    return({"html_path": html_path, "json_path": json_path, "results": results})
+
+
+#%%
+if __name__ == "__main__":
+    init_paths = my_utils.initialize_paths("logs", "strava_data", "strava_report")
+    my_utils.setup_logging(init_paths["log_file_path"])
+
+    # Report on the latest published snapshot, no API calls and never blocked by a running sync
+    con = snapshots.connect_to_current_snapshot()
+    generate_report(con, cache=query_cache.QueryCache())
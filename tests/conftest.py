@@ -0,0 +1,111 @@
+#%%
+import os
+import sys
+import copy
+import random
+from datetime import datetime, timedelta
+import pytest
+
+# The modules under test live in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import my_utils
+import analysis_queries
+import reconcile
+
+#%%
+# A synthetic athlete and a mocked activities API, shared by the tests
+
+
+def build_activities(n: int, seed: int = 7):
+    r = random.Random(seed)
+    activities = []
+    start = datetime(2023, 1, 1, 7)
+    for i in range(n):
+        start += timedelta(hours=r.randint(20, 50))
+        activity_type = r.choice(["Run", "Run", "Ride", "Walk"])
+        distance = round(r.uniform(2000, 20000), 1)
+        moving_time = int(distance / r.uniform(2.5, 4.0))
+        lat, lng = 37.77 + r.randint(0, 3) * 0.01, -122.42
+        activities.append({
+            "id": 1000 + i, "athlete": {"id": 42, "resource_state": 1}, "name": f"Activity {i}"
+            , "type": activity_type, "sport_type": activity_type, "workout_type": None
+            , "start_date": start.strftime("%Y-%m-%dT%H:%M:%SZ")
+            , "start_date_local": (start - timedelta(hours=8)).strftime("%Y-%m-%dT%H:%M:%SZ")
+            , "distance": distance, "moving_time": moving_time, "elapsed_time": moving_time + r.randint(0, 600)
+            , "total_elevation_gain": round(r.uniform(0, 200), 1), "average_speed": distance / moving_time, "max_speed": 6.0
+            , "has_heartrate": True, "average_heartrate": round(r.uniform(120, 170), 1), "max_heartrate": 185.0
+            , "average_watts": 200.0 if activity_type == "Ride" else None, "weighted_average_watts": 210.0 if activity_type == "Ride" else None
+            , "kilojoules": 500.0 if activity_type == "Ride" else None, "kudos_count": r.randint(0, 10)
+            , "gear_id": r.choice(["g1", "g2", None]), "commute": False, "trainer": False, "private": False
+            , "start_latlng": [lat, lng], "end_latlng": [lat + 0.01, lng]
+            , "map": {"id": f"a{i}", "summary_polyline": None, "resource_state": 2}
+            , "device_name": "Watch", "timezone": "(GMT-08:00) America/Los_Angeles", "achievement_count": 0
+            , "comment_count": 0, "athlete_count": 1, "photo_count": 0, "manual": False, "elev_high": 50.0, "elev_low": 10.0
+            , "average_cadence": 80.0, "max_watts": 400 if activity_type == "Ride" else None, "device_watts": activity_type == "Ride"
+            , "heartrate_opt_out": False, "display_hide_heartrate_option": True, "pr_count": 0, "total_photo_count": 0
+            , "has_kudoed": False, "upload_id": 5000 + i, "upload_id_str": str(5000 + i), "external_id": f"{i}.fit"
+            , "from_accepted_tag": False,
+        })
+    return(activities)
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code: int = 200):
+        self.payload = payload
+        self.status_code = status_code
+        self.headers = {}
+        self.text = str(payload)
+
+    def json(self):
+        return(self.payload)
+
+
+class FakeStrava:
+    # Newest first by default, oldest first once after is given, like the activities API
+    def __init__(self, activities: list):
+        self.activities = activities
+        self.activity_requests = 0
+
+    def request(self, method, url, params=None, **kwargs):
+        if url.endswith("/oauth/token"):
+            return(FakeResponse({"access_token": "token"}))
+        if "/gear/" in url:
+            gear_id = url.rsplit("/", 1)[1]
+            return(FakeResponse({"id": gear_id, "name": f"Shoe {gear_id}"}))
+        self.activity_requests += 1
+        params = params or {}
+        activities = sorted(self.activities, key=lambda a: (reconcile.to_epoch(a["start_date"]), a["id"]))
+        if "before" in params:
+            activities = [a for a in activities if reconcile.to_epoch(a["start_date"]) < params["before"]]
+        if "after" in params:
+            activities = [a for a in activities if reconcile.to_epoch(a["start_date"]) > params["after"]]
+        else:
+            activities = activities[::-1]
+        per_page, page = params.get("per_page", 30), params.get("page", 1)
+        return(FakeResponse(copy.deepcopy(activities[(page - 1) * per_page:page * per_page])))
+
+
+#%%
+@pytest.fixture
+def make_activities():
+    return(build_activities)
+
+
+@pytest.fixture
+def load_activities():
+    # API-shaped activities as raw_activities, with staging built from them
+    def load(con, activities: list):
+        con.register("synced_activities", my_utils.pages_to_arrow([activities], datetime.now()))
+        con.execute("CREATE OR REPLACE TABLE raw_activities AS SELECT * FROM synced_activities")
+        con.unregister("synced_activities")
+        analysis_queries.build_staging_tables(con)
+    return(load)
+
+
+@pytest.fixture
+def strava(monkeypatch):
+    fake = FakeStrava(build_activities(400))
+    monkeypatch.setattr(my_utils.requests, "request", fake.request)
+    for name in ("STRAVA_CLIENT_ID", "STRAVA_CLIENT_SECRET", "STRAVA_REFRESH_TOKEN"):
+        monkeypatch.setenv(name, "test")
+    return(fake)
@@ -0,0 +1,18 @@
+#%%
+import duckdb
+import analysis_server
+
+#%%
+def test_load_copies_only_served_tables(tmp_path):
+    snapshot_path = str(tmp_path / "snapshot.duckdb")
+    con = duckdb.connect(snapshot_path)
+    con.execute("CREATE TABLE staging AS SELECT range AS id FROM range(3)")
+    con.execute("CREATE TABLE activity_streams AS SELECT range AS id, range AS point_index FROM range(1000)")
+    con.execute("CREATE TABLE activity_details AS SELECT 1 AS id, '{}'::JSON AS payload")
+    con.close()
+
+    database = analysis_server.WarmDatabase()
+    database.load(snapshot_path)
+    assert database.run_sql("SELECT count(*) FROM staging")["rows"] == [(3,)]
+    loaded = {row[0] for row in database.con.execute("SELECT table_name FROM duckdb_tables()").fetchall()}
+    assert loaded == {"staging"}
@@ -0,0 +1,86 @@
+#%%
+import time
+import threading
+from datetime import datetime
+import duckdb
+import pytest
+import my_utils
+import enrichment
+
+#%%
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.headers = {}
+        self.text = str(status_code)
+
+    def json(self):
+        return({})
+
+
+@pytest.fixture
+def con(monkeypatch):
+    con = duckdb.connect()
+    start = datetime(2024, 1, 1)
+    con.execute("CREATE TABLE staging AS SELECT range AS id, ?::TIMESTAMPTZ + range * INTERVAL 1 DAY AS start_date_utc FROM range(1, 21)", [start])
+    monkeypatch.setattr(my_utils, "refresh_access_token", lambda: "token")
+    return(con)
+
+
+def test_recent_failure_is_retried_before_backlog(con, monkeypatch):
+    fetched = []
+    def fetch(activity_id, headers, request_counter):
+        request_counter.increment()
+        fetched.append(activity_id)
+        return({"id": activity_id, "status_code": 500 if activity_id == 20 else 200, "payload": {}})
+    monkeypatch.setattr(enrichment, "fetch_activity_details", fetch)
+
+    enrichment.run_enrichment(con, daily_limit=2, budget_share=1, concurrency=1)
+    assert fetched == [20, 19]
+    # Next day the failed newest activity still comes first
+    con.execute("UPDATE enrichment_usage SET usage_date = usage_date - 1")
+    fetched.clear()
+    enrichment.run_enrichment(con, daily_limit=2, budget_share=1, concurrency=1)
+    assert fetched == [20, 18]
+
+    # Past the cap it is skipped
+    con.execute("UPDATE enrichment_queue SET attempts = ? WHERE id = 20", [enrichment.max_attempts])
+    con.execute("DELETE FROM enrichment_usage")
+    fetched.clear()
+    enrichment.run_enrichment(con, daily_limit=2, budget_share=1, concurrency=1)
+    assert fetched == [17, 16]
+
+
+def test_rate_limit_keeps_requests_in_flight(con, monkeypatch):
+    # Three requests in flight together, the middle one hits the daily limit
+    in_flight = threading.Barrier(3)
+    def fetch(activity_id, headers, request_counter):
+        request_counter.increment()
+        in_flight.wait(5)
+        if activity_id == 19:
+            raise my_utils.RateLimitExceeded("limit")
+        # Answered after the limit was hit
+        time.sleep(0.2)
+        return({"id": activity_id, "status_code": 200, "payload": {}})
+    monkeypatch.setattr(enrichment, "fetch_activity_details", fetch)
+
+    assert enrichment.run_enrichment(con, daily_limit=20, budget_share=1, concurrency=3) == 2
+    assert sorted(row[0] for row in con.execute("SELECT id FROM activity_details").fetchall()) == [18, 20]
+    assert con.execute("SELECT requests FROM enrichment_usage").fetchone()[0] == 3
+    assert con.execute("SELECT count(*) FROM enrichment_queue").fetchone()[0] == 18
+
+
+def test_retries_count_against_the_budget(con, monkeypatch):
+    # The first attempt at each activity is a transient 503, the retry succeeds
+    statuses = {}
+    def request(method, url, **kwargs):
+        activity_id = int(url.rsplit("/", 1)[1])
+        statuses[activity_id] = 200 if activity_id in statuses else 503
+        return(FakeResponse(statuses[activity_id]))
+    monkeypatch.setattr(my_utils.requests, "request", request)
+    monkeypatch.setattr(my_utils.time, "sleep", lambda secs: None)
+
+    # Two activities use up a budget of four requests, the other two selected aren't sent
+    assert enrichment.run_enrichment(con, daily_limit=4, budget_share=1, concurrency=1) == 2
+    assert con.execute("SELECT requests FROM enrichment_usage").fetchone()[0] == 4
+    assert con.execute("SELECT count(*) FROM enrichment_queue WHERE attempts = 0").fetchone()[0] == 18
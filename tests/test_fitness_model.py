@@ -0,0 +1,38 @@
+#%%
+from datetime import date
+import duckdb
+import fitness_model
+
+#%%
+def get_fitness_state(con):
+    return({
+        "thresholds": con.execute("SELECT athlete_id, round(ftp_watts, 6), max_heartrate FROM fitness_thresholds ORDER BY ALL").fetchall()
+        ,"stress": con.execute("SELECT id, round(stress_score, 6), stress_method FROM activity_stress ORDER BY id").fetchall()
+        ,"fitness": con.execute("SELECT athlete_id, activity_date, round(ctl, 6), round(atl, 6) FROM fitness_daily ORDER BY ALL").fetchall()
+    })
+
+
+def test_thresholds_follow_new_history(make_activities, load_activities):
+    through_date = date(2025, 6, 1)
+    activities = make_activities(120)
+    runs = [a for a in activities if a["type"] != "Ride"]
+    # No power at all on the first sync, so no FTP
+    first_batch = [a for a in runs if a["start_date"] < "2023-07-01"]
+
+    incremental = duckdb.connect()
+    load_activities(incremental, first_batch)
+    fitness_model.update_fitness(incremental, through_date)
+    assert incremental.execute("SELECT ftp_watts FROM fitness_thresholds").fetchone()[0] is None
+
+    # Rides with power and a harder effort arrive later
+    activities[-1]["max_heartrate"] = 199.0
+    load_activities(incremental, activities)
+    fitness_model.update_fitness(incremental, through_date)
+    state = get_fitness_state(incremental)
+    assert state["thresholds"][0][1] is not None and state["thresholds"][0][2] == 199.0
+    assert {method for _, _, method in state["stress"]} >= {"power", "heartrate"}
+
+    rebuilt = duckdb.connect()
+    load_activities(rebuilt, activities)
+    fitness_model.update_fitness(rebuilt, through_date, full_rebuild=True)
+    assert state == get_fitness_state(rebuilt)
@@ -0,0 +1,20 @@
+#%%
+import duckdb
+import pace_index
+
+#%%
+def test_save_writes_only_changed_rows():
+    con = duckdb.connect()
+    con.execute("CREATE TABLE staging AS SELECT range AS id, 'Run' AS name, 'Run' AS sport_type, 5.0::DOUBLE AS distance_miles, 8.0::DOUBLE + range / 10 AS average_pace_mins_per_mile FROM range(1, 11)")
+    pace_index.update_pace_index(con)
+    # Rows deleted and inserted again get new rowids, untouched ones keep theirs
+    saved_rowids = dict(con.execute("SELECT id, rowid FROM pace_index_entries").fetchall())
+
+    con.execute("INSERT INTO staging VALUES (11, 'Run', 'Run', 5.0, 7.5)")
+    index = pace_index.PaceIndex(con)
+    index.remove(2)
+    ranks = pace_index.update_pace_index(con, index)
+    assert [r["id"] for r in ranks] == [11]
+    rowids = dict(con.execute("SELECT id, rowid FROM pace_index_entries").fetchall())
+    assert sorted(rowids) == [1] + list(range(3, 12))
+    assert all(rowids[activity_id] == saved_rowids[activity_id] for activity_id in rowids if activity_id != 11)
@@ -0,0 +1,62 @@
+#%%
+import os
+import sys
+import json
+import subprocess
+import duckdb
+import analysis_queries
+import query_cache
+import strava_report
+
+#%%
+def test_cached_results_match_uncached(tmp_path, make_activities, load_activities):
+    con = duckdb.connect()
+    load_activities(con, make_activities(300))
+    con.execute("CREATE TABLE dataset_load AS SELECT 'test' AS source_file, 'fingerprint' AS fingerprint, now() AS loaded_at")
+
+    # Region tags come from regions.py, not the staging tables
+    queries = {name: sql for name, sql in analysis_queries.report_queries.items() if name != "regions_visited"}
+    uncached = strava_report.run_report_queries(con, queries)
+    cache = query_cache.QueryCache(str(tmp_path / "cache"))
+    first = strava_report.run_report_queries(con, queries, cache=cache)
+    second = strava_report.run_report_queries(con, queries, cache=cache)
+    assert all(r["cached"] for r in second)
+    for results in (first, second):
+        for expected, actual in zip(uncached, results):
+            # weekly_running_streak returns the same column name twice
+            assert (actual["columns"], actual["rows"]) == (expected["columns"], expected["rows"]), expected["name"]
+
+
+def test_processes_sharing_a_cache_keep_every_entry(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    script = f'''
+import sys
+sys.path.insert(0, {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))!r})
+import duckdb, query_cache
+cache, con = query_cache.QueryCache({cache_dir!r}), duckdb.connect()
+for i in range(25):
+    cache.put(con.cursor(), f"SELECT {{sys.argv[1]}} AS worker, {{i}} AS i", "fingerprint")
+'''
+    workers = [subprocess.Popen([sys.executable, "-c", script, str(n)]) for n in range(4)]
+    assert all(worker.wait() == 0 for worker in workers)
+
+    with open(os.path.join(cache_dir, "index.json")) as f:
+        index = json.load(f)
+    files = os.listdir(cache_dir)
+    assert len(index) == 100
+    assert sorted(f for f in files if f.endswith(".parquet")) == sorted(v["file"] for v in index.values())
+    assert not [f for f in files if f.endswith(".tmp")]
+
+
+def test_loads_side_by_side_share_the_cache(tmp_path):
+    cache, con = query_cache.QueryCache(str(tmp_path / "cache")), duckdb.connect()
+    # Readers of the previous snapshot and the new one caching at the same time
+    cache.put(con.cursor(), "SELECT 1 AS x", "previous")
+    cache.put(con.cursor(), "SELECT 1 AS x", "current")
+    assert cache.get(con.cursor(), "SELECT 1 AS x", "previous") == {"columns": ["x"], "rows": [(1,)]}
+
+    # Evicted by another process after the index was read is a miss, not an error
+    entry = cache.index[query_cache.make_cache_key("SELECT 1 AS x", "current")]
+    os.remove(os.path.join(cache.cache_dir, entry["file"]))
+    cache._read_index = lambda: {query_cache.make_cache_key("SELECT 1 AS x", "current"): entry}
+    assert cache.get(con.cursor(), "SELECT 1 AS x", "current") is None
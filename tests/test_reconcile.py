@@ -0,0 +1,137 @@
+#%%
+import copy
+import math
+from datetime import datetime, timedelta
+import duckdb
+import my_utils
+import analysis_queries
+import training_load
+import fitness_model
+import gear
+import pace_index
+import routes
+import reconcile
+
+#%%
+# A synthetic athlete against a mocked activities API: an incremental reconcile has to end up
+# with the same derived state as a full reload of the same remote history
+
+
+def sync(con, export_path: str, full_reload: bool):
+    if full_reload:
+        table, edited_ids = my_utils.download_data_from_strava(export_path), []
+        # Like data_load, a reload over an existing history takes back what it deleted or changed
+        if reconcile.has_local_history(con):
+            edited_ids = reconcile.forget_replaced_history(con, table)["edited"]
+    else:
+        table, changes = reconcile.reconcile_activities(con, export_path)
+        edited_ids = changes["edited"]
+    con.register("synced_activities", table)
+    con.execute("CREATE OR REPLACE TABLE raw_activities AS SELECT * FROM synced_activities")
+    con.unregister("synced_activities")
+    analysis_queries.build_staging_tables(con)
+    training_load.update_daily_training_load(con)
+    fitness_model.update_fitness(con)
+    gear.resolve_gear(con)
+    gear.update_gear_counters(con)
+    pace_index.update_pace_index(con, edited_ids=edited_ids)
+    routes.update_activity_routes(con)
+
+
+def get_derived_state(con):
+    queries = {
+        "raw": "SELECT id, name, round(distance, 1) FROM raw_activities ORDER BY id"
+        ,"training_load": "SELECT athlete_id, activity_date, activity_count, round(distance_meters_7d, 3), round(distance_meters_28d, 3) FROM daily_training_load ORDER BY ALL"
+        ,"fitness": "SELECT athlete_id, activity_date, round(ctl, 6), round(atl, 6) FROM fitness_daily ORDER BY ALL"
+        ,"stress": "SELECT id, round(stress_score, 6) FROM activity_stress ORDER BY id"
+        ,"gear": "SELECT gear_id, round(distance_meters, 3), activity_count FROM gear_counters ORDER BY gear_id"
+        ,"routes": "SELECT id FROM activity_routes ORDER BY id"
+    }
+    state = {name: con.execute(sql).fetchall() for name, sql in queries.items()}
+    state["pace_index"] = sorted(pace_index.PaceIndex(con).entries.items())
+    return(state)
+
+
+def change_remote_history(activities: list, deleted: list, backdated_after: int, edited: int):
+    # Positions are oldest first
+    by_position = sorted(activities, key=lambda a: reconcile.to_epoch(a["start_date"]))
+    backdated = copy.deepcopy(by_position[backdated_after])
+    backdated["id"], backdated["name"] = 900000, "Backdated upload"
+    backdated["start_date"] = (datetime.strptime(backdated["start_date"], "%Y-%m-%dT%H:%M:%SZ") + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    late = copy.deepcopy(by_position[-1])
+    late["id"], late["name"] = 900001, "Late upload"
+    late["start_date"] = (datetime.strptime(late["start_date"], "%Y-%m-%dT%H:%M:%SZ") + timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    by_position[edited]["name"] = "Renamed"
+    by_position[edited]["distance"] += 1500.0
+    deleted_ids = {by_position[position]["id"] for position in deleted}
+    activities[:] = [a for a in activities if a["id"] not in deleted_ids] + [backdated, late]
+    return(deleted_ids)
+
+
+def run_until_converged(strava, tmp_path, local, expected_ids: set):
+    # Syncs until the local history matches, at most one full audit cycle
+    max_syncs = math.ceil(len(expected_ids) / reconcile.leaf_size) + 2
+    for sync_count in range(1, max_syncs + 1):
+        sync(local, str(tmp_path / f"reconciled_{sync_count}.parquet"), full_reload=False)
+        if {row[0] for row in local.execute("SELECT id FROM raw_activities").fetchall()} == expected_ids:
+            return(sync_count)
+    return(None)
+
+
+#%%
+def test_reconcile_matches_full_reload(strava, tmp_path):
+    local = duckdb.connect()
+    sync(local, str(tmp_path / "initial.parquet"), full_reload=True)
+
+    # A deletion and a backdated upload in the same half of history keep its count
+    deleted_ids = change_remote_history(strava.activities, deleted=[60, 200, 330], backdated_after=150, edited=20)
+    strava.activity_requests = 0
+    sync(local, str(tmp_path / "reconciled.parquet"), full_reload=False)
+    local_ids = {row[0] for row in local.execute("SELECT id FROM raw_activities").fetchall()}
+    assert not deleted_ids & local_ids
+    assert {900000, 900001} <= local_ids
+    assert strava.activity_requests < 40
+
+    # Old edits outside every listed bucket are picked up by the rotating audit
+    expected_ids = {a["id"] for a in strava.activities}
+    assert run_until_converged(strava, tmp_path, local, expected_ids) is not None
+    for _ in range(math.ceil(len(expected_ids) / reconcile.leaf_size) + 1):
+        sync(local, str(tmp_path / "audit.parquet"), full_reload=False)
+
+    reloaded = duckdb.connect()
+    sync(reloaded, str(tmp_path / "reloaded.parquet"), full_reload=True)
+    assert get_derived_state(local) == get_derived_state(reloaded)
+
+
+def test_full_reload_matches_fresh_load(strava, tmp_path):
+    local = duckdb.connect()
+    sync(local, str(tmp_path / "initial.parquet"), full_reload=True)
+
+    change_remote_history(strava.activities, deleted=[60, 399], backdated_after=150, edited=20)
+    sync(local, str(tmp_path / "reloaded.parquet"), full_reload=True)
+    assert local.execute("SELECT count(*) FROM activity_changes").fetchone()[0] == 5
+
+    fresh = duckdb.connect()
+    sync(fresh, str(tmp_path / "fresh.parquet"), full_reload=True)
+    assert get_derived_state(local) == get_derived_state(fresh)
+
+
+def test_changes_side_by_side_converge(strava, tmp_path):
+    local = duckdb.connect()
+    sync(local, str(tmp_path / "initial.parquet"), full_reload=True)
+
+    # Deleted right next to the backdated upload, no sampled position lies between them
+    deleted_ids = change_remote_history(strava.activities, deleted=[101], backdated_after=100, edited=100)
+    expected_ids = {a["id"] for a in strava.activities}
+    assert run_until_converged(strava, tmp_path, local, expected_ids) is not None
+    assert not deleted_ids & {row[0] for row in local.execute("SELECT id FROM raw_activities").fetchall()}
+
+
+def test_unchanged_history_is_cheap(strava, tmp_path):
+    local = duckdb.connect()
+    sync(local, str(tmp_path / "initial.parquet"), full_reload=True)
+    strava.activity_requests = 0
+    sync(local, str(tmp_path / "reconciled.parquet"), full_reload=False)
+    # Recent window (1), root bucket probe (item n+1 and four samples), a full audit bucket (2 pages)
+    assert strava.activity_requests <= 8
+    assert local.execute("SELECT count(*) FROM activity_changes").fetchone()[0] == 0
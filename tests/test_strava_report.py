@@ -0,0 +1,14 @@
+#%%
+import strava_report
+
+#%%
+def test_report_escapes_user_text(tmp_path):
+    results = [{"name": "top_kudos_runs", "columns": ["name", "kudos"], "secs": 0.1, "cached": False
+                , "rows": [("<img src=x onerror=alert(1)>", 3), ("Hills & <b>wind</b>", 1)]}]
+    html_path = str(tmp_path / "report.html")
+    strava_report.render_report(results, html_path)
+    with open(html_path) as f:
+        html = f.read()
+    assert "<img" not in html and "<b>" not in html
+    assert "&lt;img src=x onerror=alert(1)&gt;" in html
+    assert "Hills &amp; &lt;b&gt;wind&lt;/b&gt;" in html
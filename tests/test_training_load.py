@@ -0,0 +1,24 @@
+#%%
+import duckdb
+import training_load
+
+#%%
+def get_training_load(con):
+    return(con.execute("SELECT athlete_id, activity_date, activity_count, round(distance_meters_7d, 3) FROM daily_training_load ORDER BY ALL").fetchall())
+
+
+def test_deleted_newest_activity_matches_rebuild(make_activities, load_activities):
+    activities = make_activities(60)
+    incremental = duckdb.connect()
+    load_activities(incremental, activities)
+    training_load.update_daily_training_load(incremental)
+
+    # The newest activity is deleted, nothing is left to compute after its day
+    newest = max(activities, key=lambda a: a["start_date"])
+    load_activities(incremental, [a for a in activities if a is not newest])
+    training_load.update_daily_training_load(incremental)
+
+    rebuilt = duckdb.connect()
+    load_activities(rebuilt, [a for a in activities if a is not newest])
+    training_load.update_daily_training_load(rebuilt, full_rebuild=True)
+    assert get_training_load(incremental) == get_training_load(rebuilt)
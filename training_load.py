@@ -0,0 +1,180 @@
+#%%
+import logging
+import numpy as np
+import pandas as pd
+
+#%%
+acute_days = 7
+chronic_days = 28
+# Rows of already computed history needed to extend the windows (plus one week for the ramp)
+history_days = chronic_days + acute_days
+
+create_daily_training_load_sql = '''
+    CREATE TABLE IF NOT EXISTS daily_training_load (
+        athlete_id BIGINT
+        ,activity_date DATE
+        ,activity_count BIGINT
+        ,distance_meters DOUBLE
+        ,moving_time_secs DOUBLE
+        ,distance_meters_7d DOUBLE
+        ,distance_meters_28d DOUBLE
+        ,moving_time_secs_7d DOUBLE
+        ,moving_time_secs_28d DOUBLE
+        ,distance_ramp_pct DOUBLE
+        ,moving_time_ramp_pct DOUBLE
+        ,distance_acute_chronic_ratio DOUBLE
+        ,moving_time_acute_chronic_ratio DOUBLE
+        ,PRIMARY KEY (athlete_id, activity_date)
+    )
+'''
+
+daily_totals_sql = '''
+    SELECT
+        athlete_id
+        ,date(start_date_local) AS activity_date
+        ,count(*) AS activity_count
+        ,sum(distance_meters) AS distance_meters
+        ,sum(moving_time_secs) AS moving_time_secs
+    FROM staging
+    GROUP BY ALL
+'''
+
+# Resume from the last computed day (recomputed, it may have gained activities since), or from the
+# first earlier day whose saved totals no longer match staging (a backdated upload, a deleted activity)
+resume_points_sql = f'''
+    CREATE OR REPLACE TEMP TABLE resume_points AS
+    WITH saved AS (
+        SELECT athlete_id, max(activity_date) AS last_date
+        FROM daily_training_load
+        GROUP BY athlete_id
+    )
+    , daily AS ({daily_totals_sql})
+    , changed AS (
+        SELECT athlete_id, min(activity_date) AS first_changed_date
+        FROM (
+            (SELECT athlete_id, activity_date, activity_count, round(distance_meters, 3), round(moving_time_secs, 3) FROM daily
+            EXCEPT
+            SELECT athlete_id, activity_date, activity_count, round(distance_meters, 3), round(moving_time_secs, 3) FROM daily_training_load)
+            UNION ALL
+            (SELECT athlete_id, activity_date, activity_count, round(distance_meters, 3), round(moving_time_secs, 3) FROM daily_training_load WHERE activity_count > 0
+            EXCEPT
+            SELECT athlete_id, activity_date, activity_count, round(distance_meters, 3), round(moving_time_secs, 3) FROM daily)
+        )
+        GROUP BY athlete_id
+    )
+    SELECT s.athlete_id, least(s.last_date, c.first_changed_date) AS resume_date
+    FROM saved s
+    LEFT JOIN changed c USING (athlete_id)
+'''
+
+# Gap-filled daily spine from each athlete's resume day to their latest activity
+daily_spine_sql = f'''
+    WITH daily AS ({daily_totals_sql})
+    , bounds AS (
+        SELECT
+            d.athlete_id
+            ,coalesce(r.resume_date, min(d.activity_date)) AS start_date
+            ,max(d.activity_date) AS end_date
+        FROM daily d
+        LEFT JOIN resume_points r ON r.athlete_id = d.athlete_id
+        GROUP BY d.athlete_id, r.resume_date
+    )
+    , spine AS (
+        SELECT
+            athlete_id
+            ,unnest(generate_series(start_date, end_date, INTERVAL 1 DAY))::DATE AS activity_date
+        FROM bounds
+        WHERE start_date <= end_date
+    )
+    SELECT
+        s.athlete_id
+        ,s.activity_date
+        ,coalesce(d.activity_count, 0) AS activity_count
+        ,coalesce(d.distance_meters, 0) AS distance_meters
+        ,coalesce(d.moving_time_secs, 0) AS moving_time_secs
+    FROM spine s
+    LEFT JOIN daily d USING (athlete_id, activity_date)
+    ORDER BY s.athlete_id, s.activity_date
+'''
+
+
+#%%
+def rolling_sum(values: np.ndarray, window: int):
+    # Window sums as a difference of cumulative sums, no per-day loop
+    cumulative = np.concatenate([[0.0], np.cumsum(values, dtype=float)])
+    ends = np.arange(1, len(values) + 1)
+    sums = cumulative[ends] - cumulative[np.maximum(ends - window, 0)]
+    return(sums)
+
+
+def safe_ratio(numerator: np.ndarray, denominator: np.ndarray):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(denominator > 0, numerator / denominator, np.nan)
+    return(ratio)
+
+
+def compute_rolling_load(daily: pd.DataFrame):
+    # daily is one athlete's gap-filled spine, history rows first
+    daily = daily.copy()
+    for measure in ["distance_meters", "moving_time_secs"]:
+        values = daily[measure].to_numpy(dtype=float)
+        acute = rolling_sum(values, acute_days)
+        chronic = rolling_sum(values, chronic_days)
+        previous_acute = np.concatenate([np.full(acute_days, np.nan), acute[:-acute_days]])[:len(acute)]
+
+        prefix = measure.replace("_meters", "").replace("_secs", "")
+        daily[f"{measure}_{acute_days}d"] = acute
+        daily[f"{measure}_{chronic_days}d"] = chronic
+        daily[f"{prefix}_ramp_pct"] = safe_ratio(acute - previous_acute, previous_acute) * 100
+        # Acute load against the chronic weekly average
+        daily[f"{prefix}_acute_chronic_ratio"] = safe_ratio(acute, chronic / (chronic_days / acute_days))
+
+    return(daily)
+
+
+#%%
+def update_daily_training_load(con, full_rebuild: bool = False):
+    logging.info("Starting the update_daily_training_load() function")
+
+    if full_rebuild:
+        con.execute("DROP TABLE IF EXISTS daily_training_load")
+    con.execute(create_daily_training_load_sql)
+
+    con.execute(resume_points_sql)
+    new_days = con.execute(daily_spine_sql).df()
+    # Saved days from the resume day on go even when nothing follows them,
+    # after the newest activity is deleted its day lies past the end of the new spine
+    con.execute('''
+        DELETE FROM daily_training_load
+        USING resume_points r
+        WHERE daily_training_load.athlete_id = r.athlete_id
+            AND daily_training_load.activity_date >= r.resume_date
+    ''')
+    if new_days.empty:
+        logging.info("No new days to compute")
+        return(0)
+
+    history = con.execute(f'''
+        SELECT h.athlete_id, h.activity_date, h.activity_count, h.distance_meters, h.moving_time_secs
+        FROM daily_training_load h
+        JOIN resume_points r ON r.athlete_id = h.athlete_id
+        WHERE h.activity_date < r.resume_date
+            AND h.activity_date >= r.resume_date - INTERVAL {history_days} DAY
+        ORDER BY h.athlete_id, h.activity_date
+    ''').df()
+
+    computed = []
+    for athlete_id, athlete_days in new_days.groupby("athlete_id"):
+        athlete_history = history[history["athlete_id"] == athlete_id]
+        spine = pd.concat([athlete_history, athlete_days], ignore_index=True)
+        computed.append(compute_rolling_load(spine).iloc[len(athlete_history):])
+    computed = pd.concat(computed, ignore_index=True)
+
+    con.register("computed_training_load", computed)
+    con.execute("INSERT INTO daily_training_load BY NAME SELECT * FROM computed_training_load")
+    con.unregister("computed_training_load")
+
+    logging.info(f"Computed {len(computed)} days of training load")
+    logging.info("update_daily_training_load() function completed")
+
+    return(len(computed))